@@ -1,43 +1,105 @@
 from __future__ import annotations
-import os, uuid
-from datetime import datetime, timedelta
+import os, uuid, json
+from datetime import datetime
 from dotenv import load_dotenv
-from flask import Flask, render_template, redirect, url_for, request, flash, jsonify
+from flask import Flask, render_template, redirect, url_for, request, flash, jsonify, g
 from flask_login import LoginManager, login_user, logout_user, login_required, current_user
-from flask_socketio import SocketIO, join_room, leave_room, emit
-from sqlalchemy import create_engine
+from flask_socketio import SocketIO, join_room, leave_room, emit, rooms
+from sqlalchemy.exc import IntegrityError
 from sqlalchemy.orm import sessionmaker, scoped_session
 
-from models import Base, User, Room, Membership, Game, PlayerState, Role, Action, Phase, RoomRoleConfig
-from security import hash_password, verify_password
+from models import User, Room, Membership, Game, Role, Phase, RoomRoleConfig
+from security import hash_password, verify_password, needs_rehash, IdentityCache
 from forms import RegisterForm, LoginForm, CreateRoomForm
-from game_engine import init_roles, assign_roles, next_phase, role_by_user
+from game_engine import init_roles, next_phase, claim_phase, start_game, add_member, StartGameError
 from role_effects import resolve_night_with_roles, resolve_day_vote_with_roles
+from role_rules import action_types
+from game_state import GameStore
+from game_journal import replay
+from archive import Archiver, load_game, replay_archived
+from stats import Stats, LEADERBOARD
+from scheduler import DeadlineScheduler
+from room_directory import RoomDirectory
+from room_router import RoomRouter, LeaseManager, KombuTransport, default_worker_id, kombu_connection_args
+from fanout import FanOut, audiences_for, room_name, pick_codec, encode
+from metrics import Metrics
+from database import make_engine, pool_gate
 
 load_dotenv()
 DATABASE_URL = os.getenv("DATABASE_URL")
 SECRET_KEY = os.getenv("FLASK_SECRET_KEY","dev-secret")
 MESSAGE_QUEUE = os.getenv("SOCKETIO_MESSAGE_QUEUE")
+ROUTER_URL = os.getenv("ROOM_ROUTER_URL")  # 设置后启用按房间分片的多进程模式
+NIGHT_ACTIONS, DAY_ACTIONS = action_types("night"), action_types("day")
 
-engine = create_engine(DATABASE_URL, pool_pre_ping=True)
-SessionLocal = scoped_session(sessionmaker(bind=engine, expire_on_commit=False))
+engine = make_engine(DATABASE_URL)
+metrics = Metrics()
+metrics.instrument_engine(engine)
+if pool_gate(engine): metrics.watch_pool(pool_gate(engine))
+# 每个 greenthread 一个 Session：未 monkey_patch 时 threading.local 在所有 greenthread 间共享，
+# 而 psycopg2 查询期间会让出 hub，共用 Session 会在同一连接上并发执行、被其他 handler 的 remove() 关闭
+try: from eventlet.corolocal import get_ident as _session_scope
+except ImportError: from threading import get_ident as _session_scope
+SessionLocal = scoped_session(sessionmaker(bind=engine, expire_on_commit=False), scopefunc=_session_scope)
+games = GameStore(sessionmaker(bind=engine, expire_on_commit=False))
 
 app = Flask(__name__)
 app.config["SECRET_KEY"] = SECRET_KEY
-socketio = SocketIO(app, cors_allowed_origins="*", message_queue=MESSAGE_QUEUE, async_mode="eventlet")
+sio_options = {}
+if MESSAGE_QUEUE and MESSAGE_QUEUE.startswith("filesystem://"):
+    # 本地多进程测试：用共享目录代替 Redis/AMQP
+    import socketio as python_socketio
+    url, opts = kombu_connection_args(MESSAGE_QUEUE)
+    sio_options["client_manager"] = python_socketio.KombuManager(url, channel="flask-socketio", connection_options=opts)
+socketio = SocketIO(app, cors_allowed_origins="*", message_queue=MESSAGE_QUEUE, async_mode="eventlet", **sio_options)
+
+if ROUTER_URL:
+    WORKER_ID = default_worker_id()
+    router = RoomRouter(LeaseManager(sessionmaker(bind=engine, expire_on_commit=False), WORKER_ID,
+                                     ttl=float(os.getenv("ROOM_LEASE_TTL", "15"))),
+                        KombuTransport(ROUTER_URL, WORKER_ID), on_change=games.reset)
+else:
+    router = RoomRouter()
+
+directory = RoomDirectory(sessionmaker(bind=engine, expire_on_commit=False),
+                          lambda event, payload: socketio.emit(event, payload, to="lobby"))
+fanout = FanOut(lambda event, data, room: socketio.emit(event, data, to=room),
+                buffer_size=int(os.getenv("ROOM_EVENT_BUFFER", "64")))
+metrics.gauge("werewolf_active_games", lambda: len(games))
+metrics.gauge("werewolf_lobby_rooms", lambda: len(directory))
+metrics.gauge("werewolf_connected_sockets", lambda: metrics.sockets)
 
 login_manager = LoginManager(app)
 login_manager.login_view = "login"
 
-@login_manager.user_loader
-def load_user(user_id: str):
+def _load_identity(user_id: int):
     db = SessionLocal()
-    try: return db.get(User, int(user_id))
+    try: return db.get(User, user_id)
     finally: db.close()
 
+identities = IdentityCache(_load_identity, ttl=float(os.getenv("IDENTITY_CACHE_TTL", "30")))
+
+@login_manager.user_loader
+def load_user(user_id: str):
+    return identities.get(int(user_id))
+
 @app.teardown_appcontext
 def remove_session(exc=None): SessionLocal.remove()
 
+@app.before_request
+def begin_metrics():
+    g.metrics_span = metrics.begin("http", request.url_rule.rule if request.url_rule else "unmatched")
+
+@app.teardown_request
+def end_metrics(exc=None): metrics.end(g.pop("metrics_span", None))
+
+@app.route("/metrics")
+def metrics_endpoint():
+    # 仅本机（或 METRICS_ALLOW 中列出的地址）可访问
+    allowed = {"127.0.0.1", "::1"} | set(filter(None, os.getenv("METRICS_ALLOW", "").split(",")))
+    if request.remote_addr not in allowed: return "forbidden\n", 403
+    return app.response_class(metrics.render(), mimetype="text/plain; version=0.0.4")
+
 @app.route("/")
 def index():
     if current_user.is_authenticated: return redirect(url_for("lobby"))
@@ -66,6 +128,9 @@ def login():
             u = db.query(User).filter(User.email==form.email.data).first()
             if not u or not verify_password(form.password.data, u.password_hash):
                 flash("邮箱或密码错误","danger"); return render_template("login.html", form=form)
+            if needs_rehash(u.password_hash):
+                u.password_hash = hash_password(form.password.data); db.commit()
+                identities.invalidate(u.id)
             login_user(u); return redirect(url_for("lobby"))
         finally: db.close()
     return render_template("login.html", form=form)
@@ -74,27 +139,34 @@ def login():
 @login_required
 def logout(): logout_user(); return redirect(url_for("index"))
 
+_all_roles = []
+def all_roles(db):
+    # 角色库启动后不变，缓存在进程内
+    if not _all_roles:
+        init_roles(db)
+        _all_roles.extend(db.query(Role).order_by(Role.camp, Role.name).all())
+    return _all_roles
+
 @app.route("/lobby", methods=["GET","POST"])
 @login_required
 def lobby():
     form = CreateRoomForm()
     db = SessionLocal()
     try:
-        rooms = db.query(Room).order_by(Room.id.desc()).limit(50).all()
-        init_roles(db)
-        all_roles = db.query(Role).order_by(Role.camp, Role.name).all()
+        roles = all_roles(db)
         if form.validate_on_submit():
             room = Room(name=form.name.data or f"房间-{uuid.uuid4().hex[:6]}", owner_id=current_user.id,
                         max_players=max(5, int(form.max_players.data or 8)), created_at=datetime.utcnow())
-            db.add(room); db.commit()
-            # 保存角色配置
-            for role in all_roles:
+            db.add(room); db.flush()
+            # 保存角色配置，与房间、房主成员关系同一事务提交
+            for role in roles:
                 cnt = int(request.form.get(f"role_{role.id}", 0) or 0)
                 if cnt>0: db.add(RoomRoleConfig(room_id=room.id, role_id=role.id, count=cnt))
-            db.commit()
             db.add(Membership(user_id=current_user.id, room_id=room.id)); db.commit()
+            directory.add(room, current_user.nickname, members=1)
             return redirect(url_for("room", room_id=room.id))
-        return render_template("lobby.html", form=form, rooms=rooms, all_roles=all_roles)
+        # 房间列表由前端通过 /api/rooms 与 lobby 频道获取
+        return render_template("lobby.html", form=form, all_roles=roles)
     finally: db.close()
 
 @app.route("/room/<int:room_id>")
@@ -105,8 +177,10 @@ def room(room_id: int):
         room = db.get(Room, room_id)
         if not room:
             flash("房间不存在","warning"); return redirect(url_for("lobby"))
-        if not db.query(Membership).filter_by(user_id=current_user.id, room_id=room_id).first():
-            db.add(Membership(user_id=current_user.id, room_id=room_id)); db.commit()
+        joined = add_member(db, room_id, current_user.id)
+        if joined is None:
+            flash("房间已满","warning"); return redirect(url_for("lobby"))
+        if joined: directory.member_joined(room_id)
         game = db.query(Game).filter_by(room_id=room_id, finished=False).first()
         players = db.query(User).join(Membership, Membership.user_id==User.id).filter(Membership.room_id==room_id).all()
         return render_template("room.html", room=room, game=game, players=players)
@@ -117,22 +191,17 @@ def room(room_id: int):
 def start(room_id: int):
     db = SessionLocal()
     try:
-        room = db.get(Room, room_id)
-        if not room: flash("房间不存在","warning"); return redirect(url_for("lobby"))
-        if room.owner_id != current_user.id:
-            flash("只有房主可以开始游戏","danger"); return redirect(url_for("room", room_id=room_id))
-        members = db.query(Membership).filter_by(room_id=room_id).all()
-        if len(members) < 5:
-            flash("至少 5 人才能开始","warning"); return redirect(url_for("room", room_id=room_id))
-        old = db.query(Game).filter_by(room_id=room_id, finished=False).first()
-        if old: old.finished=True; db.commit()
-        game = Game(room_id=room_id, created_at=datetime.utcnow(), finished=False)
-        db.add(game); db.commit()
-        assign_roles(db, game.id)
-        phase = Phase(game_id=game.id, number=1, type="night", ends_at=datetime.utcnow()+timedelta(seconds=90))
-        db.add(phase); db.commit()
-        socketio.emit("game_started", {"game_id": game.id}, to=f"room_{room_id}")
-        socketio.emit("phase_change", {"phase":"night","deadline":phase.ends_at.isoformat()}, to=f"room_{room_id}")
+        try: game, phase, created = start_game(db, room_id, current_user.id)
+        except StartGameError as e:
+            flash(str(e), e.category)
+            return redirect(url_for("lobby") if e.to_lobby else url_for("room", room_id=room_id))
+        except IntegrityError:
+            # 另一个进程同时开局，部分唯一索引保证只有一局生效
+            db.rollback(); return redirect(url_for("room", room_id=room_id))
+        if not created: return redirect(url_for("room", room_id=room_id))
+        router.dispatch("game_started", room_id)
+        deadlines.add(room_id, game.id, phase.id, phase.ends_at)
+        directory.set_status(room_id, "playing")
         return redirect(url_for("room", room_id=room_id))
     finally: db.close()
 
@@ -142,92 +211,264 @@ def start(room_id: int):
 def api_state(room_id: int):
     db = SessionLocal()
     try:
-        game = db.query(Game).filter_by(room_id=room_id, finished=False).first()
-        if not game: return jsonify({"phase":"waiting","players":[],"role_key":None})
-        phase = db.query(Phase).filter_by(game_id=game.id).order_by(Phase.number.desc()).first()
-        deadline = phase.ends_at.isoformat() if phase and phase.ends_at else None
-        ps_list = db.query(PlayerState).filter_by(game_id=game.id).all()
-        users = {u.id: u for u in db.query(User).all()}
-        me_ps = next((ps for ps in ps_list if ps.user_id==current_user.id), None)
-        me_role = None
-        if me_ps: me_role = (db.get(Role, me_ps.role_id)).key
-        players = [{"id":ps.user_id,"nickname":users[ps.user_id].nickname,"alive":ps.alive,"is_self":ps.user_id==current_user.id} for ps in ps_list]
-        return jsonify({"phase":phase.type if phase else "night","deadline":deadline,"players":players,"role_key":me_role})
+        st = games.get(db, room_id, None if router.is_local(room_id) else 1.0)
+        if not st: return jsonify(fanout.snapshot(room_id, None, current_user.id))
+        etag = f"{st.game_id}-{st.version}-{current_user.id}"
+        if request.if_none_match.contains(etag):
+            resp = app.response_class(status=304); resp.set_etag(etag); return resp
+        body = st.snapshot()
+        me = st.players.get(current_user.id)
+        # 公开快照按版本缓存，每个请求只拼接自己的身份；seq 供 Socket.IO 重连时补发
+        body = body[:-1] + (f',"role_key":{json.dumps(me.role_key if me else None)},"self_id":{current_user.id},'
+                            f'"seq":{fanout.events.last_seq(room_id)}}}')
+        resp = app.response_class(body, mimetype="application/json")
+        resp.set_etag(etag); resp.headers["Cache-Control"] = "private, no-cache"
+        return resp
     finally: db.close()
 
+@app.route("/api/replay/<int:game_id>")
+@login_required
+def api_replay(game_id: int):
+    # 重建任意阶段的对局状态（断线恢复/观战追帧）；进行中的对局隐藏他人身份与行动
+    db = SessionLocal()
+    try:
+        game = db.get(Game, game_id)
+        if not game: return jsonify({"error": "not found"}), 404
+        state, seq, _ = replay(db, game_id, request.args.get("phase", type=int))
+        if state is None and game.finished: state, seq, _ = replay_archived(db, game_id, request.args.get("phase", type=int))
+        if state is None: return jsonify({"error": "no journal"}), 404
+        if not game.finished:
+            me = str(current_user.id)
+            state["players"] = {uid: ([None, None, None] + pl[3:4] + [{}] + pl[5:]) if uid != me else pl
+                                for uid, pl in state["players"].items()}
+            state["actions"] = {uid: a for uid, a in state["actions"].items() if uid == me}
+            state["effects"] = {}
+        return jsonify({"game_id": game_id, "seq": seq, "finished": game.finished, "state": state})
+    finally: db.close()
+
+@app.route("/api/games/<int:game_id>")
+@login_required
+def api_game(game_id: int):
+    # 已结束对局的完整记录（身份、各阶段、行动、事件），已归档的从 game_archives 解压读取
+    db = SessionLocal()
+    try:
+        game = db.get(Game, game_id)
+        if not game: return jsonify({"error": "not found"}), 404
+        if not game.finished: return jsonify({"error": "game in progress"}), 403
+        record = load_game(db, game_id)
+        if record is None: return jsonify({"error": "archive expired"}), 404
+        return jsonify(record)
+    finally: db.close()
+
+@app.route("/api/stats/users/<int:user_id>")
+@login_required
+def api_user_stats(user_id: int):
+    d = stats.user(user_id)
+    return jsonify(d) if d else (jsonify({"error": "no games"}), 404)
+
+@app.route("/api/stats/roles")
+@login_required
+def api_role_stats():
+    return jsonify({"roles": stats.roles()})
+
+@app.route("/api/stats/leaderboard")
+@login_required
+def api_leaderboard():
+    by = request.args.get("by", "wins")
+    if by not in LEADERBOARD: return jsonify({"error": "by must be one of " + ", ".join(LEADERBOARD)}), 400
+    limit = min(100, max(1, request.args.get("limit", 20, type=int)))
+    return jsonify({"by": by, "users": stats.leaderboard(by, limit, max(0, request.args.get("min_games", 5, type=int)))})
+
+@app.route("/api/rooms")
+@login_required
+def api_rooms():
+    return jsonify(directory.page(request.args.get("before", type=int), request.args.get("limit", 20, type=int)))
+
 # -------- Socket.IO --------
 @socketio.on("connect")
 def on_connect():
     if not current_user.is_authenticated: return False
+    metrics.sockets += 1
+
+@socketio.on("disconnect")
+def on_disconnect():
+    if current_user.is_authenticated: metrics.sockets -= 1
 
+@socketio.on("join_lobby")
+@metrics.timed("socket", "join_lobby")
+def on_join_lobby(data=None):
+    join_room("lobby"); emit("lobby_joined", {})
+
+# 按当前身份/存活状态加入观众子房间；客户端在开局和自己死亡后重新发送 join_room
 @socketio.on("join_room")
+@metrics.timed("socket", "join_room")
 def on_join(data):
-    rid = int(data.get("room_id")); join_room(f"room_{rid}"); emit("joined", {"room_id":rid})
+    rid = int(data.get("room_id")); codec = pick_codec(data.get("codec"))
+    db = SessionLocal()
+    try: st = games.get(db, rid, None if router.is_local(rid) else 1.0)
+    finally: db.close()
+    want = {room_name(rid, aud, codec) for aud in audiences_for(st, current_user.id)}
+    for r in rooms():
+        if r.startswith(f"room_{rid}:") and r not in want: leave_room(r)
+    for r in want: join_room(r)
+    emit("joined", {"room_id":rid, "codec": "msgpack" if codec == "mp" else "json"})
+    if st and not st.is_alive(current_user.id) and current_user.id in st.players:
+        emit("private", encode(fanout.reveal(st, current_user.id), codec))
+    if data.get("last_seq") is not None:
+        # 重连：事件缓冲在房间持有者进程上，经 router 补发
+        router.dispatch("resume", rid, current_user.id, request.sid, {"last_seq": int(data["last_seq"]), "codec": codec})
 
 @socketio.on("leave_room")
+@metrics.timed("socket", "leave_room")
 def on_leave(data):
-    rid = int(data.get("room_id")); leave_room(f"room_{rid}"); emit("left", {"room_id":rid})
+    rid = int(data.get("room_id"))
+    for r in rooms():
+        if r.startswith(f"room_{rid}:"): leave_room(r)
+    emit("left", {"room_id":rid})
 
-@socketio.on("night_action")
-def on_night_action(data):
+# 结算当前阶段并进入下一阶段；调用方需持有 st.lock。
+# 全部必需玩家行动完毕或截止时间到时调用，claim_phase 保证每个阶段只结算一次
+def _advance(db, st, rid):
+    phase = st.phase
+    if not claim_phase(db, phase.id): return False
+    deadlines.cancel(phase.id)
+    night = phase.type == "night"
+    roles = st.role_map()
+    res = (resolve_night_with_roles if night else resolve_day_vote_with_roles)(db, st.game_id, phase, st.phase_actions(), roles, st.tally)
+    died, touched = st.apply_role_map(roles)
+    wolf_target = st.tally.wolf_votes.most_common(1)[0][0] if night and st.tally.wolf_votes else None
+    games.record_resolution(st, res, died, touched, "night" if night else "exile")
+    winner = st.wins.winner(phase, res)
+    if winner:
+        games.finish(db, st, winner)
+        directory.set_status(rid, "waiting")
+        fanout.game_over(st, winner, res, died)
+        return True
+    np = next_phase(db, st.game_id, "day" if night else "night")
+    games.open_phase(st, np["phase"])
+    deadlines.add(rid, st.game_id, np["phase"].id, np["deadline"])
+    fanout.phase_changed(st, "night" if night else "day", res, died, wolf_target)
+    return True
+
+# 以下 handler 由 router 调用：单进程时直接执行，分片模式下只在房间租约持有者上执行
+@router.handler("deadline")
+@metrics.timed("task", "deadline")
+def handle_deadline(rid, user_id, sid, data):
+    game_id, phase_id = data["game_id"], data["phase_id"]
+    db = SessionLocal()
+    try:
+        st = games.get(db, rid)
+        if not st or st.game_id != game_id or not st.phase: return
+        if st.phase.id != phase_id:
+            # 截止的不是内存中的当前阶段：通常是该阶段已提前结算，直接忽略；
+            # 只有库中该阶段比内存更新（由其他进程推进）时才先落盘缓冲再重新加载
+            ph = db.get(Phase, phase_id)
+            if not ph or ph.resolved_at is not None or ph.number <= st.phase.number: return
+            games.writer.flush(); games.reset(rid); st = games.get(db, rid)
+            if not st or not st.phase or st.phase.id != phase_id: return
+        with st.lock:
+            if st.phase.id == phase_id: _advance(db, st, rid)
+    finally: db.close(); SessionLocal.remove()
+
+@router.handler("game_started")
+@metrics.timed("task", "game_started")
+def handle_game_started(rid, user_id, sid, data):
+    games.reset(rid)
+    db = SessionLocal()
+    try:
+        st = games.get(db, rid)
+        if st and st.phase: fanout.game_started(st)
+    finally: db.close(); SessionLocal.remove()
+
+@router.handler("resume")
+@metrics.timed("task", "resume")
+def handle_resume(rid, user_id, sid, data):
+    db = SessionLocal()
+    try:
+        st = games.get(db, rid)
+        missed = fanout.missed(rid, st, user_id, data["last_seq"])
+        if missed is None:
+            socketio.emit("snapshot", encode(fanout.snapshot(rid, st, user_id), data["codec"]), to=sid)
+        else:
+            for event, payload in missed: socketio.emit(event, encode(payload, data["codec"]), to=sid)
+    finally: db.close(); SessionLocal.remove()
+
+@router.handler("night_action")
+@metrics.timed("task", "night_action")
+def handle_night_action(rid, user_id, sid, data):
     db = SessionLocal()
     try:
-        rid = int(data.get("room_id"))
-        game = db.query(Game).filter_by(room_id=rid, finished=False).first()
-        if not game: return
-        phase = db.query(Phase).filter_by(game_id=game.id).order_by(Phase.number.desc()).first()
-        if phase.type != "night": return
+        st = games.get(db, rid)
+        if not st or st.phase_type != "night": return
         target_user_id = data.get("target_user_id")
         action_type = data.get("action")
+        if action_type not in NIGHT_ACTIONS:
+            socketio.emit("error_msg", {"message": "无效的行动"}, to=sid); return
         if target_user_id is not None: target_user_id = int(target_user_id)
-        ps = db.query(PlayerState).filter_by(game_id=game.id, user_id=current_user.id).first()
-        if not ps or not ps.alive: return
-        # 简化的权限检查：前端负责露出对应按钮
-        a = db.query(Action).filter_by(game_id=game.id, phase_number=phase.number, actor_user_id=current_user.id).first()
-        if not a:
-            a = Action(game_id=game.id, phase_number=phase.number, actor_user_id=current_user.id, type=action_type, target_user_id=target_user_id)
-            db.add(a)
-        else:
-            a.type = action_type; a.target_user_id = target_user_id
-        db.commit()
-        emit("action_ok", {"action":action_type,"target":target_user_id})
-        acts = db.query(Action).filter_by(game_id=game.id, phase_number=phase.number).all()
-        res = resolve_night_with_roles(db, game.id, phase, acts)
-        if res:
-            np = next_phase(db, game.id, "day")
-            socketio.emit("night_resolved", {"summary":res}, to=f"room_{rid}")
-            socketio.emit("phase_change", {"phase":"day","deadline":np["deadline"].isoformat()}, to=f"room_{rid}")
-    finally: db.close()
+        # 丘比特/吹笛者等需要第二个目标
+        meta = {"target2": int(data["target2"])} if data.get("target2") is not None else None
+        with st.lock:
+            if st.phase_type != "night" or not st.is_alive(user_id): return
+            # 行动类型已校验；身份不符的行动在 role_rules 中被忽略
+            games.record_action(st, user_id, action_type, target_user_id, meta)
+            socketio.emit("action_ok", {"action":action_type,"target":target_user_id}, to=sid)
+            if st.tally.complete: _advance(db, st, rid)
+    finally: db.close(); SessionLocal.remove()
 
-@socketio.on("day_vote")
-def on_day_vote(data):
+@router.handler("day_vote")
+@metrics.timed("task", "day_vote")
+def handle_day_vote(rid, user_id, sid, data):
     db = SessionLocal()
     try:
-        rid = int(data.get("room_id"))
-        game = db.query(Game).filter_by(room_id=rid, finished=False).first()
-        if not game: return
-        phase = db.query(Phase).filter_by(game_id=game.id).order_by(Phase.number.desc()).first()
-        if phase.type != "day": return
+        st = games.get(db, rid)
+        if not st or st.phase_type != "day": return
         target_user_id = data.get("target_user_id")
         if target_user_id is not None: target_user_id = int(target_user_id)
-        ps = db.query(PlayerState).filter_by(game_id=game.id, user_id=current_user.id).first()
-        if not ps or not ps.alive: return
-        a = db.query(Action).filter_by(game_id=game.id, phase_number=phase.number, actor_user_id=current_user.id).first()
-        if not a:
-            a = Action(game_id=game.id, phase_number=phase.number, actor_user_id=current_user.id, type="day_vote", target_user_id=target_user_id); db.add(a)
-        else:
-            a.type = "day_vote"; a.target_user_id = target_user_id
-        db.commit()
-        acts = db.query(Action).filter_by(game_id=game.id, phase_number=phase.number).all()
-        res = resolve_day_vote_with_roles(db, game.id, phase, acts)
-        if res:
-            np = next_phase(db, game.id, "night")
-            socketio.emit("day_resolved", {"summary":res}, to=f"room_{rid}")
-            socketio.emit("phase_change", {"phase":"night","deadline":np["deadline"].isoformat()}, to=f"room_{rid}")
-    finally: db.close()
+        action_type = data.get("action") or "day_vote"
+        if action_type not in DAY_ACTIONS:
+            socketio.emit("error_msg", {"message": "无效的行动"}, to=sid); return
+        with st.lock:
+            if st.phase_type != "day" or not st.is_alive(user_id): return
+            games.record_action(st, user_id, action_type, target_user_id)
+            # 骑士决斗成功立即结束白天，不等其余投票
+            if st.tally.complete or (action_type == "knight_duel" and st.duel_wins(user_id, target_user_id)): _advance(db, st, rid)
+    finally: db.close(); SessionLocal.remove()
+
+deadlines = DeadlineScheduler(sessionmaker(bind=engine, expire_on_commit=False),
+                              lambda rid, game_id, phase_id: router.dispatch("deadline", rid, data={"game_id": game_id, "phase_id": phase_id}))
+stats = Stats(sessionmaker(bind=engine), flush=games.writer.flush, ttl=float(os.getenv("STATS_CACHE_TTL", "30")))
+archiver = Archiver(sessionmaker(bind=engine), interval=float(os.getenv("ARCHIVE_INTERVAL", "300")))
+
+@socketio.on("night_action")
+@metrics.timed("socket", "night_action")
+def on_night_action(data):
+    router.dispatch("night_action", int(data.get("room_id")), current_user.id, request.sid, data)
+
+@socketio.on("day_vote")
+@metrics.timed("socket", "day_vote")
+def on_day_vote(data):
+    router.dispatch("day_vote", int(data.get("room_id")), current_user.id, request.sid, data)
+
+def migrate():
+    # 等价于 `alembic upgrade head`；旧的 create_all 库也可直接升级
+    from alembic import command
+    from alembic.config import Config
+    cfg = Config(os.path.join(os.path.dirname(os.path.abspath(__file__)), "alembic.ini"))
+    cfg.attributes["configure_logger"] = False
+    with engine.connect() as conn:
+        cfg.attributes["connection"] = conn
+        command.upgrade(cfg, "head")
 
 if __name__ == "__main__":
-    Base.metadata.create_all(bind=engine)
+    migrate()
     with SessionLocal() as db:
         init_roles(db)  # 初始化角色库
-    socketio.run(app, host="0.0.0.0", port=5000)
+    socketio.start_background_task(games.writer.run, socketio.sleep)  # 行动异步批量落盘
+    socketio.start_background_task(deadlines.run, socketio.sleep)     # 阶段截止自动结算
+    directory.load()
+    socketio.start_background_task(directory.run, socketio.sleep)     # 大厅目录定期同步
+    socketio.start_background_task(metrics.watch_hub, socketio.sleep) # eventlet hub 阻塞检测
+    socketio.start_background_task(archiver.run, socketio.sleep)      # 已结束对局移出活跃表
+    socketio.start_background_task(stats.run, socketio.sleep)         # 已结束对局计入玩家/身份统计
+    if router.enabled: socketio.start_background_task(router.run, socketio.sleep)  # 租约续约 + 接收转发事件
+    socketio.run(app, host="0.0.0.0", port=int(os.getenv("PORT", "5000")))
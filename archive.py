@@ -0,0 +1,148 @@
+from __future__ import annotations
+import argparse, json, logging, os, sys, zlib
+from collections import defaultdict
+from datetime import datetime, timedelta
+from typing import Optional
+from sqlalchemy import delete, func, update
+from models import Game, Phase, PlayerState, Action, GameEvent, GameSnapshot, GameArchive, upsert
+from game_journal import empty_state, apply_event
+
+log = logging.getLogger(__name__)
+
+# 冷热分离：已结束超过 ARCHIVE_AFTER_MINUTES 的对局，其 player_states / phases / actions / game_events
+# 按批压缩成一行 game_archives（zlib 压缩的 JSON lines，每行 [表名, 行]），随后从活跃表删除；
+# game_snapshots 可由事件重建，直接删除。games 行本身保留（胜方、时间），供历史列表使用，并记录 archived_at。
+# 归档保留 ARCHIVE_RETENTION_DAYS 天，0 表示永久保留；过期删除后 archived_at 仍在，对局不会被再次归档。
+#
+#   python archive.py              归档全部到期对局并清理过期归档（可放进 cron）
+#   python archive.py --dry-run    只统计待归档数量
+
+ARCHIVE_AFTER = timedelta(minutes=float(os.getenv("ARCHIVE_AFTER_MINUTES", "60")))
+ARCHIVE_RETENTION = timedelta(days=float(os.getenv("ARCHIVE_RETENTION_DAYS", "0")))
+ARCHIVE_BATCH = int(os.getenv("ARCHIVE_BATCH", "50"))
+
+# (表名, 模型, 列, 排序)；读取归档时按表名还原
+TABLES = (
+    ("player_states", PlayerState, ("user_id", "role_id", "alive", "meta"), PlayerState.id),
+    ("phases", Phase, ("id", "number", "type", "ends_at", "resolved_at"), Phase.number),
+    ("actions", Action, ("phase_number", "actor_user_id", "type", "target_user_id", "created_at"), Action.id),
+    ("game_events", GameEvent, ("seq", "phase_number", "kind", "payload", "created_at"), GameEvent.seq),
+)
+GAME_COLS = ("id", "room_id", "created_at", "finished_at", "winner")
+
+def _iso(v): return v.isoformat() if isinstance(v, datetime) else v
+
+def _line(table: str, obj, cols) -> bytes:
+    return json.dumps([table, {c: _iso(getattr(obj, c)) for c in cols}], ensure_ascii=False, separators=(",", ":")).encode()
+
+def due_games(db, now: Optional[datetime] = None, limit: int = ARCHIVE_BATCH) -> list:
+    # 已结束、超过保留窗口且尚未归档的对局；旧版对局没有 finished_at 时按 created_at 计
+    cutoff = (now or datetime.utcnow()) - ARCHIVE_AFTER
+    return [gid for (gid,) in db.query(Game.id)
+            .filter(Game.finished==True, Game.archived_at.is_(None),
+                    func.coalesce(Game.finished_at, Game.created_at) < cutoff)
+            .order_by(Game.id).limit(limit)]
+
+def archive_games(db, game_ids) -> int:
+    # 一批对局：每张表一次查询读出、一次 DELETE 删除，归档行 ON CONFLICT DO NOTHING，多进程重复执行也安全
+    if not game_ids: return 0
+    lines = defaultdict(list)
+    for g in db.query(Game).filter(Game.id.in_(game_ids)):
+        lines[g.id].append(_line("game", g, GAME_COLS))
+    for table, model, cols, order in TABLES:
+        for obj in db.query(model).filter(model.game_id.in_(game_ids)).order_by(model.game_id, order):
+            lines[obj.game_id].append(_line(table, obj, cols))
+    now = datetime.utcnow()
+    rows = [{"game_id": gid, "rows": len(ls) - 1, "data": zlib.compress(b"\n".join(ls), 6), "archived_at": now}
+            for gid, ls in lines.items()]
+    upsert(db, GameArchive, rows, ["game_id"])
+    db.execute(update(Game).where(Game.id.in_(game_ids)).values(archived_at=now))
+    for model in (GameSnapshot, GameEvent, Action, Phase, PlayerState):
+        db.execute(delete(model).where(model.game_id.in_(game_ids)))
+    db.commit()
+    return sum(r["rows"] for r in rows)
+
+def prune(db, now: Optional[datetime] = None) -> int:
+    if not ARCHIVE_RETENTION: return 0
+    n = db.execute(delete(GameArchive).where(GameArchive.archived_at < (now or datetime.utcnow()) - ARCHIVE_RETENTION)).rowcount
+    db.commit()
+    return n
+
+def load_archive(db, game_id: int) -> Optional[dict]:
+    # {"game": {...}, "player_states": [...], "phases": [...], "actions": [...], "game_events": [...]}
+    row = db.get(GameArchive, game_id)
+    if row is None: return None
+    out = {"game": None, **{t: [] for t, *_ in TABLES}}
+    for line in zlib.decompress(row.data).splitlines():
+        table, r = json.loads(line)
+        if table == "game": out["game"] = r
+        else: out[table].append(r)
+    return out
+
+def load_game(db, game_id: int) -> Optional[dict]:
+    # 历史读取：未归档的从活跃表读，已归档的解压归档，返回结构相同；归档已过期删除时返回 None
+    arc = load_archive(db, game_id)
+    if arc is not None: return arc
+    game = db.get(Game, game_id)
+    if game is None or game.archived_at is not None: return None
+    out = {"game": json.loads(_line("game", game, GAME_COLS))[1]}
+    for table, model, cols, order in TABLES:
+        out[table] = [json.loads(_line(table, obj, cols))[1] for obj in db.query(model).filter(model.game_id==game_id).order_by(order)]
+    return out
+
+def replay_archived(db, game_id: int, upto_phase: Optional[int] = None):
+    # 与 game_journal.replay 相同的返回值，数据来自归档中的事件
+    arc = load_archive(db, game_id)
+    if arc is None or not arc["game_events"]: return None, 0, 0
+    state = empty_state(); seq = n = 0
+    for ev in arc["game_events"]:
+        if upto_phase is not None and (ev["phase_number"] is None or ev["phase_number"] > upto_phase): continue
+        apply_event(state, ev["kind"], ev["payload"], ev["phase_number"]); seq = ev["seq"]; n += 1
+    return state, seq, n
+
+class Archiver:
+    def __init__(self, session_factory, interval: float = 300.0, batch: int = ARCHIVE_BATCH):
+        self.session_factory = session_factory; self.interval = interval; self.batch = batch
+
+    def run_once(self, sleep=None) -> int:
+        # 每批一个事务；批与批之间让出，避免长时间占用 hub 和数据库
+        total = 0
+        db = self.session_factory()
+        try:
+            while True:
+                ids = due_games(db, limit=self.batch)
+                if not ids: break
+                n = archive_games(db, ids); total += len(ids)
+                log.info("archived %d games (%d rows)", len(ids), n)
+                if sleep: sleep(0)
+            pruned = prune(db)
+            if pruned: log.info("pruned %d archives", pruned)
+        finally: db.close()
+        return total
+
+    def run(self, sleep):
+        while True:
+            sleep(self.interval)
+            try: self.run_once(sleep)
+            except Exception: log.exception("archive batch failed")
+
+def main(argv=None):
+    from dotenv import load_dotenv
+    load_dotenv()
+    ap = argparse.ArgumentParser(description="归档已结束的对局并清理过期归档")
+    ap.add_argument("--db", default=os.getenv("DATABASE_URL"))
+    ap.add_argument("--dry-run", action="store_true")
+    args = ap.parse_args(argv)
+    if not args.db: raise SystemExit("DATABASE_URL 未设置")
+    from sqlalchemy.orm import sessionmaker
+    from database import make_engine
+    Session = sessionmaker(bind=make_engine(args.db, green=False))
+    logging.basicConfig(level=logging.INFO, format="%(message)s")
+    if args.dry_run:
+        with Session() as db: print(len(due_games(db, limit=None)), "games due")
+        return 0
+    print(Archiver(Session).run_once(), "games archived")
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,175 @@
+from __future__ import annotations
+# 无界面对局模拟与基准测试：脚本机器人跑完整对局，统计吞吐、各结算步骤延迟分位数和每阶段查询数。
+#   python bench.py --games 2000 --players 12 --mix classic --save bench_baseline.json
+#   python bench.py --games 2000 --compare bench_baseline.json      # 回归超过阈值时退出码为 1
+#   python bench.py --db postgresql+psycopg2://localhost/werewolf_bench
+import argparse, json, random, sys, time
+from collections import defaultdict
+from datetime import datetime
+from sqlalchemy import event
+from sqlalchemy.orm import sessionmaker
+
+from database import make_engine
+from models import Base, User, Room, Membership, Game, Role, RoomRoleConfig
+from game_engine import ROLE_LIBRARY, init_roles, assign_roles, next_phase
+from game_state import GameState, WriteBehind, WOLF_ROLES
+from role_effects import resolve_night_with_roles, resolve_day_vote_with_roles
+
+MIXES = {
+    "classic": {"werewolf": 3, "seer": 1, "witch": 1, "hunter": 1, "guardian": 1},
+    "village": {"werewolf": 2, "seer": 1, "village_head": 1, "scapegoat": 1, "idiot": 1},
+    "neutral": {"werewolf": 3, "seer": 1, "witch": 1, "cupid": 1, "piper": 1, "angel": 1},
+}
+NIGHT_ACTIONS = {"seer": "seer_peek", "witch": "witch_poison", "guardian": "guardian_protect",
+                 "raven": "raven_mark", "piper": "piper_charm", "cupid": "bind_couple"}
+
+def parse_mix(spec: str, players: int, rng: random.Random) -> dict:
+    if spec in MIXES: return dict(MIXES[spec])
+    if spec == "random":
+        # 从全量角色库随机抽取，保证至少两只狼
+        keys = [k for k in ROLE_LIBRARY if k != "villager"]
+        mix = {"werewolf": 2}
+        for k in rng.sample(keys, min(len(keys), max(0, players - 4))): mix[k] = mix.get(k, 0) + 1
+        return mix
+    mix = {}
+    for part in spec.split(","):
+        k, _, n = part.partition("=")
+        if k not in ROLE_LIBRARY: raise SystemExit(f"unknown role: {k}")
+        mix[k] = int(n or 1)
+    return mix
+
+class QueryCounter:
+    def __init__(self, engine):
+        self.count = 0
+        event.listen(engine, "before_cursor_execute", self._on_execute)
+    def _on_execute(self, *args): self.count += 1
+
+def percentiles(samples):
+    if not samples: return {}
+    s = sorted(samples); n = len(s)
+    pick = lambda q: s[min(n - 1, int(q * n))] * 1000
+    return {"n": n, "p50_ms": round(pick(.50), 3), "p95_ms": round(pick(.95), 3),
+            "p99_ms": round(pick(.99), 3), "max_ms": round(s[-1] * 1000, 3)}
+
+def play_game(Session, room_id, rng, timings, qc, per_phase_queries, max_phases):
+    db = Session()
+    try:
+        game = Game(room_id=room_id, created_at=datetime.utcnow(), finished=False)
+        db.add(game); db.commit()
+        t = time.perf_counter(); assign_roles(db, game.id); timings["assign_roles"].append(time.perf_counter() - t)
+        t = time.perf_counter(); next_phase(db, game.id, "night"); timings["next_phase"].append(time.perf_counter() - t)
+        t = time.perf_counter(); st = GameState.load(db, room_id); timings["load_state"].append(time.perf_counter() - t)
+        writer = WriteBehind(Session)
+        phases = 0; winner = None
+        while phases < max_phases and not winner:
+            q0 = qc.count
+            alive = [uid for uid, p in st.players.items() if p.alive]
+            night = st.phase.type == "night"
+            # 机器人随机选择存活目标；狼人统一刀同一人以便对局推进
+            wolf_target = rng.choice([u for u in alive if st.players[u].role_key not in WOLF_ROLES] or alive)
+            for uid in alive:
+                rk = st.players[uid].role_key
+                if night:
+                    if rk in WOLF_ROLES: type_, target = "wolf_kill", wolf_target
+                    elif rk in NIGHT_ACTIONS: type_, target = NIGHT_ACTIONS[rk], rng.choice(alive)
+                    else: continue
+                else: type_, target = "day_vote", rng.choice(alive)
+                a = st.record_action(uid, type_, target, {"target2": rng.choice(alive)})
+                writer.put_action(st.game_id, st.phase.number, a)
+            writer.flush()
+            roles = st.role_map()
+            t = time.perf_counter()
+            if night: res = resolve_night_with_roles(db, st.game_id, st.phase, st.phase_actions(), roles, st.tally)
+            else: res = resolve_day_vote_with_roles(db, st.game_id, st.phase, st.phase_actions(), roles, st.tally)
+            timings["resolve_night" if night else "resolve_day"].append(time.perf_counter() - t)
+            st.apply_role_map(roles)
+            t = time.perf_counter(); winner = st.wins.winner(st.phase, res)
+            timings["win_check"].append(time.perf_counter() - t)
+            if not winner:
+                t = time.perf_counter(); np = next_phase(db, st.game_id, "day" if night else "night")
+                timings["next_phase"].append(time.perf_counter() - t)
+                st.open_phase(np["phase"])
+            per_phase_queries.append(qc.count - q0)
+            phases += 1
+        game.finished = True; game.winner = winner; db.commit()
+        return phases
+    finally: db.close()
+
+def setup(Session, players: int, games: int, mix_spec: str, rng):
+    db = Session()
+    try:
+        init_roles(db)
+        role_ids = {r.key: r.id for r in db.query(Role).all()}
+        users = [User(email=f"bot{i}@bench.local", nickname=f"bot{i}", password_hash="-") for i in range(players)]
+        db.add_all(users); db.commit()
+        rooms = []
+        # 每局一个房间，各自抽取角色配置
+        for g in range(games):
+            room = Room(name=f"bench-{g}", owner_id=users[0].id, max_players=players)
+            db.add(room); db.flush()
+            db.add_all([Membership(user_id=u.id, room_id=room.id) for u in users])
+            mix = parse_mix(mix_spec, players, rng)
+            db.add_all([RoomRoleConfig(room_id=room.id, role_id=role_ids[k], count=n) for k, n in mix.items()])
+            rooms.append(room.id)
+        db.commit()
+        return rooms
+    finally: db.close()
+
+def run(args) -> dict:
+    rng = random.Random(args.seed)
+    engine = make_engine(args.db, green=False)
+    Base.metadata.create_all(bind=engine)
+    Session = sessionmaker(bind=engine, expire_on_commit=False)
+    rooms = setup(Session, args.players, args.games, args.mix, rng)
+    qc = QueryCounter(engine)
+    timings, per_phase_queries, phases = defaultdict(list), [], 0
+    t0 = time.perf_counter()
+    for rid in rooms:
+        phases += play_game(Session, rid, rng, timings, qc, per_phase_queries, args.max_phases)
+    elapsed = time.perf_counter() - t0
+    return {
+        "meta": {"db": engine.url.render_as_string(hide_password=True), "games": args.games, "players": args.players,
+                 "mix": args.mix, "seed": args.seed, "created_at": datetime.utcnow().isoformat()},
+        "games_per_sec": round(args.games / elapsed, 2),
+        "phases_per_game": round(phases / max(1, args.games), 2),
+        "queries_per_phase": round(sum(per_phase_queries) / max(1, len(per_phase_queries)), 2),
+        "latency": {k: percentiles(v) for k, v in sorted(timings.items())},
+    }
+
+def compare(report: dict, baseline: dict, tolerance: float) -> list:
+    # 吞吐下降或 p95 延迟/每阶段查询数上升超过 tolerance 视为回归
+    problems = []
+    if report["games_per_sec"] < baseline["games_per_sec"] * (1 - tolerance):
+        problems.append(f"games_per_sec {report['games_per_sec']} < baseline {baseline['games_per_sec']}")
+    if report["queries_per_phase"] > baseline["queries_per_phase"] * (1 + tolerance):
+        problems.append(f"queries_per_phase {report['queries_per_phase']} > baseline {baseline['queries_per_phase']}")
+    for k, cur in report["latency"].items():
+        base = baseline.get("latency", {}).get(k)
+        if base and cur["p95_ms"] > base["p95_ms"] * (1 + tolerance):
+            problems.append(f"{k} p95 {cur['p95_ms']}ms > baseline {base['p95_ms']}ms")
+    return problems
+
+def main(argv=None):
+    ap = argparse.ArgumentParser(description="Werewolf engine benchmark")
+    ap.add_argument("--games", type=int, default=1000)
+    ap.add_argument("--players", type=int, default=12)
+    ap.add_argument("--mix", default="classic", help="classic|village|neutral|random 或 werewolf=3,seer=1,...")
+    ap.add_argument("--db", default="sqlite://", help="SQLAlchemy URL，默认内存 SQLite")
+    ap.add_argument("--max-phases", type=int, default=40)
+    ap.add_argument("--seed", type=int, default=42)
+    ap.add_argument("--save", help="把结果写入 JSON 作为基线")
+    ap.add_argument("--compare", help="与基线 JSON 比较")
+    ap.add_argument("--tolerance", type=float, default=0.2)
+    args = ap.parse_args(argv)
+    report = run(args)
+    print(json.dumps(report, indent=2, ensure_ascii=False))
+    if args.save:
+        with open(args.save, "w") as f: json.dump(report, f, indent=2, ensure_ascii=False)
+    if args.compare:
+        with open(args.compare) as f: problems = compare(report, json.load(f), args.tolerance)
+        for p in problems: print("REGRESSION:", p, file=sys.stderr)
+        return 1 if problems else 0
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,102 @@
+from __future__ import annotations
+import logging, os, time
+from typing import Callable, Optional
+from sqlalchemy import create_engine, event, exc
+from sqlalchemy.pool import QueuePool, StaticPool
+
+log = logging.getLogger(__name__)
+
+# 与 eventlet 协作的数据库访问：
+#   PostgreSQL  psycopg2 注册 eventlet 等待回调（eventlet 自带的 psycopg2_patcher），查询等待网络时让出 hub；
+#               连接池外加一个 FIFO 许可（PoolGate），池满时调用者按到达顺序在 greenthread 中排队，
+#               超过 DB_POOL_TIMEOUT 抛 sqlalchemy.exc.TimeoutError，而不是在 QueuePool 的线程锁上卡住整个 hub。
+#   SQLite      单机部署/测试用：文件库开启 WAL（读写互不阻塞）与 busy_timeout，内存库共用一个连接。
+# 不再使用 pool_pre_ping（每次取连接多一次往返），改为 DB_POOL_RECYCLE 定期回收空闲连接。
+
+DB_POOL_SIZE = int(os.getenv("DB_POOL_SIZE", "20"))
+DB_POOL_OVERFLOW = int(os.getenv("DB_POOL_OVERFLOW", "0"))
+DB_POOL_TIMEOUT = float(os.getenv("DB_POOL_TIMEOUT", "10"))
+DB_POOL_RECYCLE = int(os.getenv("DB_POOL_RECYCLE", "1800"))
+SQLITE_BUSY_MS = int(os.getenv("SQLITE_BUSY_TIMEOUT_MS", "5000"))
+
+try:
+    from eventlet.semaphore import Semaphore as _Semaphore   # 等待者为 FIFO 队列
+except ImportError: from threading import Semaphore as _Semaphore
+
+def make_green() -> bool:
+    try:
+        from eventlet.support.psycopg2_patcher import make_psycopg_green
+        make_psycopg_green()
+        return True
+    except ImportError: return False
+
+class PoolGate:
+    # 连接许可：数量等于池容量（pool_size + max_overflow），保证 QueuePool 自身永远不需要等待
+    def __init__(self, size: int, timeout: float):
+        self.size = size; self.timeout = timeout
+        self.in_use = 0; self.waiting = 0
+        self.on_wait: Optional[Callable[[float, bool], None]] = None   # on_wait(等待秒数, 是否拿到)
+        self._sem = _Semaphore(size)
+
+    def acquire(self):
+        t0 = time.perf_counter()
+        self.waiting += 1
+        try: ok = self._sem.acquire(timeout=self.timeout)
+        finally: self.waiting -= 1
+        if self.on_wait: self.on_wait(time.perf_counter() - t0, ok)
+        if not ok:
+            raise exc.TimeoutError(f"database pool exhausted ({self.size} connections, waited {self.timeout:.1f}s)")
+        self.in_use += 1
+
+    def release(self):
+        self.in_use -= 1; self._sem.release()
+
+class GatedQueuePool(QueuePool):
+    gate: Optional[PoolGate] = None
+
+    def _do_get(self):
+        self.gate.acquire()
+        try: return super()._do_get()
+        except BaseException:
+            self.gate.release(); raise
+
+    def _do_return_conn(self, record):
+        try: super()._do_return_conn(record)
+        finally: self.gate.release()
+
+    def recreate(self):
+        pool = super().recreate(); pool.gate = self.gate
+        return pool
+
+def _sqlite_pragmas(engine, wal: bool):
+    @event.listens_for(engine, "connect")
+    def _on_connect(dbapi_conn, record):
+        cur = dbapi_conn.cursor()
+        if wal:
+            cur.execute("PRAGMA journal_mode=WAL")
+            cur.execute("PRAGMA synchronous=NORMAL")   # WAL 下仍保证一致性，只在断电时可能丢最后的事务
+        cur.execute(f"PRAGMA busy_timeout={SQLITE_BUSY_MS}")
+        cur.close()
+
+def make_engine(url: str, green: bool = True, pool_size: int = DB_POOL_SIZE, max_overflow: int = DB_POOL_OVERFLOW,
+                timeout: float = DB_POOL_TIMEOUT):
+    # green=False 用于 bench/归档等不在 eventlet hub 中运行的脚本
+    sqlite = url.startswith("sqlite")
+    if sqlite and url in ("sqlite://", "sqlite:///:memory:"):
+        engine = create_engine(url, connect_args={"check_same_thread": False}, poolclass=StaticPool)
+        _sqlite_pragmas(engine, wal=False)
+        return engine
+    kw = {"pool_size": pool_size, "max_overflow": max_overflow, "pool_timeout": timeout}
+    if sqlite: kw["connect_args"] = {"check_same_thread": False}
+    else: kw["pool_recycle"] = DB_POOL_RECYCLE
+    if green:
+        if url.startswith("postgresql") and not make_green():
+            log.warning("psycopg2 eventlet wait callback unavailable; queries will block the hub")
+        kw["poolclass"] = GatedQueuePool
+    engine = create_engine(url, **kw)
+    if sqlite: _sqlite_pragmas(engine, wal=True)
+    if green: engine.pool.gate = PoolGate(pool_size + max_overflow, timeout)
+    return engine
+
+def pool_gate(engine) -> Optional[PoolGate]:
+    return getattr(engine.pool, "gate", None)
@@ -0,0 +1,161 @@
+from __future__ import annotations
+import json, logging, threading, time
+from collections import deque
+from typing import Dict, Optional
+from game_state import GameState, WOLF_ROLES
+
+try:
+    import msgpack  # 可选：pip install msgpack，客户端声明支持时改发二进制
+except ImportError: msgpack = None
+
+log = logging.getLogger(__name__)
+
+# 按观众分组推送：每个房间拆成若干 Socket.IO 子房间（观众 × 编码），
+# 每个观众的载荷只构造一次、每种编码只序列化一次，客户端无需再请求 /api/state。
+#   all          所有人（含观战）：阶段、倒计时、公开结算、本阶段死亡
+#   wolves       狼人阵营：队友、当晚刀口
+#   role:<key>   某身份全体持有者（如吹笛者看到被魅惑的人）
+#   user:<uid>   单个玩家：身份、查验结果、情侣
+#   dead         已死亡玩家：完整结算
+# 观战者只在 all 中。
+#
+# 每次推送带房间内递增的 seq，并保存在每个房间的环形缓冲中；客户端重连时带上 last_seq，
+# 只补发错过且仍有权看到的事件，缺口超出缓冲时才下发完整快照（snapshot 事件）。
+# 终局时向 all 推送 game_over（胜方 + 全部身份）。
+
+PUBLIC_KEYS = ("killed", "poisoned", "exiled", "scapegoat", "idiot_revealed", "win", "heartbreak", "beauty_victim",
+               "hunter_ready", "white_wolf_power", "knight", "bear_growl")
+CODECS = ("json", "mp")
+
+def room_name(room_id: int, audience: str, codec: str = "json") -> str:
+    return f"room_{room_id}:{audience}" + (":mp" if codec == "mp" else "")
+
+def pick_codec(requested: Optional[str]) -> str:
+    return "mp" if requested == "msgpack" and msgpack is not None else "json"
+
+def encode(payload: dict, codec: str):
+    return msgpack.packb(payload, use_bin_type=True) if codec == "mp" else payload
+
+def audiences_for(st: Optional[GameState], user_id: int) -> list:
+    aud = ["all", f"user:{user_id}"]
+    p = st.players.get(user_id) if st else None
+    if p is None: return aud
+    if not p.alive: return aud + ["dead"]
+    if p.role_key in WOLF_ROLES: aud.append("wolves")
+    return aud + [f"role:{p.role_key}"]
+
+def wolves_of(st: GameState) -> list:
+    return [uid for uid, p in st.players.items() if p.role_key in WOLF_ROLES]
+
+class EventBuffer:
+    # 每个房间一个按事件计数的有界环形缓冲：(seq, event, {audience: payload})，同一事件的各观众载荷一起淘汰
+    def __init__(self, size: int = 64):
+        self.size = size
+        self._rooms: Dict[int, list] = {}     # room_id -> [最新 seq, deque]
+        self._lock = threading.Lock()
+
+    def _room(self, room_id: int) -> list:
+        r = self._rooms.get(room_id)
+        if r is None:
+            # 以毫秒时间戳起步：进程重启后客户端持有的旧 seq 必然落在缓冲之外，改发快照
+            r = self._rooms[room_id] = [int(time.time() * 1000), deque(maxlen=self.size)]
+        return r
+
+    def append(self, room_id: int, event: str, payloads: Dict[str, dict]) -> int:
+        with self._lock:
+            r = self._room(room_id)
+            r[0] += 1
+            for payload in payloads.values(): payload["seq"] = r[0]
+            r[1].append((r[0], event, payloads))
+            return r[0]
+
+    def last_seq(self, room_id: int) -> int:
+        with self._lock: return self._room(room_id)[0]
+
+    def since(self, room_id: int, last_seq: int, audiences) -> Optional[list]:
+        # 返回 last_seq 之后发给 audiences 的 (event, payload)；缺口超出缓冲（或 seq 不属于本进程）时返回 None
+        with self._lock:
+            seq, buf = self._room(room_id)
+            if last_seq > seq: return None
+            if last_seq == seq: return []
+            oldest = buf[0][0] if buf else seq + 1
+            if last_seq < oldest - 1: return None
+            return [(event, payload) for s, event, payloads in buf if s > last_seq
+                    for aud, payload in payloads.items() if aud in audiences]
+
+    def clear(self, room_id: int):
+        with self._lock:
+            r = self._rooms.get(room_id)
+            if r: r[1].clear()
+
+class FanOut:
+    def __init__(self, emit, buffer_size: int = 64):
+        self.emit = emit                      # emit(event, data, room)
+        self.events = EventBuffer(buffer_size)
+
+    def _send(self, event: str, room_id: int, payloads: Dict[str, dict]):
+        self.events.append(room_id, event, payloads)
+        codecs = CODECS if msgpack is not None else ("json",)
+        for aud, payload in payloads.items():
+            for codec in codecs:
+                self.emit(event, encode(payload, codec), room_name(room_id, aud, codec))
+
+    def game_started(self, st: GameState):
+        ph = st.phase
+        out = {"all": {"game_id": st.game_id, "phase": ph.type, "n": ph.number,
+                       "deadline": ph.ends_at.isoformat() if ph.ends_at else None,
+                       "players": [[p.user_id, p.nickname, p.alive] for p in st.players.values()]}}
+        wolves = wolves_of(st)
+        self.events.clear(st.room_id)         # 上一局的事件不再补发
+        for uid, p in st.players.items():
+            out[f"user:{uid}"] = {"role_key": p.role_key, **({"wolves": wolves} if p.role_key in WOLF_ROLES else {})}
+        self._send("game_started", st.room_id, {"all": out.pop("all")})
+        self._send("private", st.room_id, out)
+
+    def phase_changed(self, st: GameState, resolved: str, summary: dict, died, wolf_target=None):
+        # 调用时 st 已进入新阶段；summary 为 role_effects 的完整结算结果
+        ph = st.phase
+        out = {"all": {"phase": ph.type, "n": ph.number, "deadline": ph.ends_at.isoformat() if ph.ends_at else None,
+                       "resolved": resolved, "summary": {k: summary[k] for k in PUBLIC_KEYS if k in summary},
+                       "dead": list(died)}}
+        private: Dict[str, dict] = {}
+        if resolved == "night" and wolf_target is not None:
+            private["wolves"] = {"target": wolf_target}
+        if summary.get("revived"): private.setdefault("wolves", {})["revived"] = summary["revived"]
+        for s in summary.get("seer", ()):
+            private.setdefault(f"user:{s['actor']}", {}).setdefault("seer", []).append([s["target"], s["is_wolf"]])
+        for s in summary.get("fox", ()):
+            private.setdefault(f"user:{s['actor']}", {})["fox"] = [s["group"], s["has_wolf"]]
+        for s in summary.get("little_girl", ()):
+            private.setdefault(f"user:{s['actor']}", {})["little_girl"] = s["wolf"]
+        for uid in summary.get("wild_kid_turned", ()):
+            private.setdefault(f"user:{uid}", {})["turned"] = True
+        for uid in summary.get("couple") or ():
+            if uid: private.setdefault(f"user:{uid}", {})["couple"] = summary["couple"]
+        if summary.get("charmed"):
+            private["role:piper"] = {"charmed": summary["charmed"]}
+            for uid in summary["charmed"]: private.setdefault(f"user:{uid}", {})["charmed"] = True
+        if any(not p.alive for p in st.players.values()): private["dead"] = {"summary": summary}
+        for payload in private.values(): payload["n"] = ph.number - 1
+        self._send("phase_change", st.room_id, out)
+        self._send("private", st.room_id, private)
+
+    def game_over(self, st: GameState, winner: str, summary: dict, died):
+        # 终局公开全部身份；之后的重连拿到的是 waiting 快照
+        out = {"winner": winner, "n": st.phase.number, "summary": {k: summary[k] for k in PUBLIC_KEYS if k in summary},
+               "dead": list(died), "roles": {str(uid): p.role_key for uid, p in st.players.items()}}
+        self._send("game_over", st.room_id, {"all": out})
+
+    def missed(self, room_id: int, st: Optional[GameState], user_id: int, last_seq: int) -> Optional[list]:
+        return self.events.since(room_id, last_seq, set(audiences_for(st, user_id)))
+
+    def snapshot(self, room_id: int, st: Optional[GameState], user_id: int) -> dict:
+        # 与 /api/state 相同的内容，外加当前 seq
+        seq = self.events.last_seq(room_id)
+        if not st: return {"phase": "waiting", "players": [], "role_key": None, "self_id": user_id, "seq": seq}
+        me = st.players.get(user_id)
+        return {**json.loads(st.snapshot()), "role_key": me.role_key if me else None, "self_id": user_id, "seq": seq}
+
+    def reveal(self, st: GameState, user_id: int) -> dict:
+        # 进入 dead 观众时单独补发全部身份
+        return {"roles": {str(uid): p.role_key for uid, p in st.players.items()}} if not st.is_alive(user_id) else {}
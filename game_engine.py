@@ -1,7 +1,9 @@
+import random
 from datetime import datetime, timedelta
 from typing import List, Dict, Optional
+from sqlalchemy import update, insert, select, func, literal
 from sqlalchemy.orm import Session
-from models import Role, Game, PlayerState, Membership, Phase, RoomRoleConfig
+from models import Role, Room, Game, PlayerState, Membership, Phase, RoomRoleConfig, dialect_insert
 
 # 全量角色库（来自你的清单），附带阵营
 ROLE_LIBRARY = {
@@ -47,37 +49,83 @@ def init_roles(db: Session):
             db.add(Role(key=key, name=name, description=desc, camp=camp))
     db.commit()
 
-def role_by_user(db: Session, game_id: int, user_id: int) -> Optional[str]:
-    ps = db.query(PlayerState).filter_by(game_id=game_id, user_id=user_id).first()
-    if not ps: return None
-    r = db.get(Role, ps.role_id)
-    return r.key if r else None
+_role_ids: Dict[str, int] = {}
+def role_ids(db: Session) -> Dict[str, int]:
+    # 角色库启动时由 init_roles 建好后不再变化，缓存 key -> id
+    if not _role_ids: _role_ids.update(db.query(Role.key, Role.id).all())
+    return _role_ids
 
-def assign_roles(db: Session, game_id: int):
-    init_roles(db)
-    game = db.get(Game, game_id)
-    members = db.query(Membership).filter_by(room_id=game.room_id).all()
-    user_ids = [m.user_id for m in members]
-    # 从房间配置构建角色池
-    configs = db.query(RoomRoleConfig).filter_by(room_id=game.room_id).all()
+def _insert_player_states(db: Session, game_id: int, room_id: int, user_ids: List[int]):
+    # 从房间配置构建角色池，其余补村民；所有 PlayerState 一条 INSERT 写入
     role_pool = []
-    for rc in configs:
-        role_pool.extend([rc.role.key] * rc.count)
-    # 其余补村民
-    while len(role_pool) < len(user_ids):
-        role_pool.append("villager")
-    import random
+    for role_id, count in db.query(RoomRoleConfig.role_id, RoomRoleConfig.count).filter_by(room_id=room_id):
+        role_pool.extend([role_id] * count)
+    villager = role_ids(db)["villager"]
+    role_pool.extend([villager] * (len(user_ids) - len(role_pool)))
+    user_ids = list(user_ids)
     random.shuffle(user_ids); random.shuffle(role_pool)
-    key_to_id = {r.key: r.id for r in db.query(Role).all()}
-    for uid, rkey in zip(user_ids, role_pool):
-        db.add(PlayerState(game_id=game.id, user_id=uid, role_id=key_to_id[rkey], alive=True, meta={}))
+    db.execute(insert(PlayerState), [{"game_id": game_id, "user_id": uid, "role_id": rid, "alive": True, "meta": {}}
+                                     for uid, rid in zip(user_ids, role_pool)])
+
+def assign_roles(db: Session, game_id: int):
+    game = db.get(Game, game_id)
+    user_ids = [uid for (uid,) in db.query(Membership.user_id).filter_by(room_id=game.room_id).order_by(Membership.id)]
+    _insert_player_states(db, game.id, game.room_id, user_ids)
     db.commit()
 
+class StartGameError(Exception):
+    def __init__(self, message: str, category: str = "warning", to_lobby: bool = False):
+        super().__init__(message); self.category = category; self.to_lobby = to_lobby
+
+def start_game(db: Session, room_id: int, user_id: int, first_phase_seconds: int = 90, debounce: float = 5.0):
+    # 单个事务开局：锁住房间行，结束旧对局、插入新对局、批量写入身份、创建第一个夜晚，最后只提交一次。
+    # 返回 (game, phase, created)；debounce 秒内的重复点击直接返回刚开的对局
+    room = db.query(Room).filter_by(id=room_id).with_for_update().one_or_none()
+    if not room: db.rollback(); raise StartGameError("房间不存在", to_lobby=True)
+    if room.owner_id != user_id: db.rollback(); raise StartGameError("只有房主可以开始游戏", "danger")
+    user_ids = [uid for (uid,) in db.query(Membership.user_id).filter_by(room_id=room_id).order_by(Membership.id)]
+    if len(user_ids) < 5: db.rollback(); raise StartGameError("至少 5 人才能开始")
+    now = datetime.utcnow()
+    current = db.query(Game).filter_by(room_id=room_id, finished=False).first()
+    if current and current.created_at and now - current.created_at < timedelta(seconds=debounce):
+        phase = db.query(Phase).filter_by(game_id=current.id).order_by(Phase.number.desc()).first()
+        db.rollback()
+        return current, phase, False
+    if current: db.execute(update(Game).where(Game.room_id==room_id, Game.finished==False).values(finished=True, finished_at=now))
+    game = Game(room_id=room_id, created_at=now, finished=False)
+    db.add(game); db.flush()
+    _insert_player_states(db, game.id, room_id, user_ids)
+    phase = Phase(game_id=game.id, number=1, type="night", ends_at=now + timedelta(seconds=first_phase_seconds))
+    db.add(phase)
+    db.commit()
+    return game, phase, True
+
+def add_member(db: Session, room_id: int, user_id: int) -> Optional[bool]:
+    # 幂等加入房间：已是成员返回 False，新加入返回 True，房间已满或不存在返回 None。
+    # 人数检查与插入是同一条 INSERT ... SELECT ... ON CONFLICT DO NOTHING；PostgreSQL 上先锁房间行，
+    # 并发加入也不会超员或重复
+    if db.query(Membership.id).filter_by(room_id=room_id, user_id=user_id).first(): return False
+    if db.bind.dialect.name == "postgresql": db.query(Room.id).filter_by(id=room_id).with_for_update().first()
+    members = select(func.count(Membership.id)).where(Membership.room_id==room_id).scalar_subquery()
+    cap = select(func.coalesce(Room.max_players, 8)).where(Room.id==room_id).scalar_subquery()
+    stmt = (dialect_insert(db, Membership)
+            .from_select(["room_id", "user_id"], select(literal(room_id), literal(user_id)).where(members < cap))
+            .on_conflict_do_nothing(index_elements=["room_id", "user_id"]))
+    res = db.execute(stmt); db.commit()
+    if res.rowcount == 1: return True
+    return False if db.query(Membership.id).filter_by(room_id=room_id, user_id=user_id).first() else None
+
 def next_phase(db: Session, game_id: int, to_type: str, seconds: int = 120) -> dict:
     last = db.query(Phase).filter_by(game_id=game_id).order_by(Phase.number.desc()).first()
     number = 1 if not last else last.number + 1
-    from datetime import datetime, timedelta
     ends = datetime.utcnow() + timedelta(seconds=seconds)
-    db.add(Phase(game_id=game_id, number=number, type=to_type, ends_at=ends))
+    phase = Phase(game_id=game_id, number=number, type=to_type, ends_at=ends)
+    db.add(phase)
+    db.commit()
+    return {"deadline": ends, "phase": phase}
+
+def claim_phase(db: Session, phase_id: int) -> bool:
+    # 条件更新：只有第一个把 resolved_at 从 NULL 改掉的调用方（进程）负责结算
+    res = db.execute(update(Phase).where(Phase.id==phase_id, Phase.resolved_at.is_(None)).values(resolved_at=datetime.utcnow()))
     db.commit()
-    return {"deadline": ends}
+    return res.rowcount == 1
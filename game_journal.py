@@ -0,0 +1,94 @@
+from __future__ import annotations
+import threading
+from datetime import datetime
+from typing import Optional
+from sqlalchemy import func
+from models import GameEvent, GameSnapshot
+
+# 每局追加写的事件日志 + 定期快照。
+# 事件：game_started / phase_opened / action_submitted / player_died / meta_changed / role_effect / game_over
+# 加载对局 = 读取最近一个快照 + 重放之后的事件；replay() 可重建任意阶段的状态。
+#
+# 状态字典（快照内容）结构，键均为字符串以便 JSON 序列化：
+#   {"room_id", "phase": {"id","number","type","ends_at"} | None,
+#    "players": {uid: [role_id, role_key, camp, alive, meta, nickname]},
+#    "actions": {actor: [type, target, meta]}, "effects": {phase_number: summary}, "winner"?}
+# 快照不携带 effects，完整结算历史以 role_effect 事件为准。
+
+def empty_state(room_id=None) -> dict:
+    return {"room_id": room_id, "phase": None, "players": {}, "actions": {}, "effects": {}}
+
+def apply_event(state: dict, kind: str, p: dict, phase_number: Optional[int] = None) -> dict:
+    if kind == "game_started":
+        state["room_id"] = p["room_id"]; state["players"] = {k: list(v) for k, v in p["players"].items()}
+    elif kind == "phase_opened":
+        state["phase"] = dict(p); state["actions"] = {}
+    elif kind == "action_submitted":
+        state["actions"][str(p["actor"])] = [p["type"], p.get("target"), p.get("meta") or {}]
+    elif kind == "player_died":
+        pl = state["players"].get(str(p["user_id"]))
+        if pl: pl[3] = False
+    elif kind == "meta_changed":
+        pl = state["players"].get(str(p["user_id"]))
+        if pl: pl[4] = p["meta"]
+    elif kind == "role_effect":
+        state["effects"][str(phase_number)] = p
+    elif kind == "game_over":
+        state["winner"] = p["winner"]
+    return state
+
+class Journal:
+    def __init__(self, writer, snapshot_every: int = 50):
+        self.writer = writer                   # game_state.WriteBehind，事件与快照随行动一起批量落盘
+        self.snapshot_every = snapshot_every
+        self._seq = {}                         # game_id -> 最新序号
+        self._since_snapshot = {}
+        self._lock = threading.Lock()
+
+    def seed(self, game_id: int, seq: int, since_snapshot: int = 0):
+        # 只前进不后退：缓冲中尚未落盘的事件序号大于库中的最大值，重新加载时不能回退
+        with self._lock:
+            if seq < self._seq.get(game_id, 0): return
+            self._seq[game_id] = seq; self._since_snapshot[game_id] = since_snapshot
+
+    def append(self, game_id: int, kind: str, payload: dict, phase_number: Optional[int] = None) -> int:
+        with self._lock:
+            seq = self._seq.get(game_id, 0) + 1
+            self._seq[game_id] = seq
+            self._since_snapshot[game_id] = self._since_snapshot.get(game_id, 0) + 1
+        self.writer.put_event({"game_id": game_id, "seq": seq, "phase_number": phase_number, "kind": kind,
+                               "payload": payload, "created_at": datetime.utcnow()})
+        return seq
+
+    def maybe_snapshot(self, game_id: int, state_fn, phase_number: Optional[int] = None) -> bool:
+        # 只在阶段边界调用：距上次快照的事件数达到阈值时写入新快照
+        if self._since_snapshot.get(game_id, 0) < self.snapshot_every: return False
+        with self._lock:
+            seq = self._seq.get(game_id, 0); self._since_snapshot[game_id] = 0
+        self.writer.put_snapshot({"game_id": game_id, "seq": seq, "phase_number": phase_number,
+                                  "state": state_fn(), "created_at": datetime.utcnow()})
+        return True
+
+    def forget(self, game_id: int):
+        with self._lock:
+            self._seq.pop(game_id, None); self._since_snapshot.pop(game_id, None)
+
+def replay(db, game_id: int, upto_phase: Optional[int] = None):
+    # 返回 (state, last_seq, events_replayed)；没有任何日志时返回 (None, 0, 0)
+    q = db.query(GameSnapshot).filter_by(game_id=game_id)
+    if upto_phase is not None: q = q.filter(GameSnapshot.phase_number <= upto_phase)
+    snap = q.order_by(GameSnapshot.seq.desc()).first()
+    state = snap.state if snap else empty_state()
+    state = {**state, "players": {k: list(v) for k, v in state["players"].items()},
+             "actions": dict(state["actions"]), "effects": dict(state["effects"])}
+    seq = snap.seq if snap else 0
+    q = db.query(GameEvent).filter(GameEvent.game_id==game_id, GameEvent.seq > seq)
+    if upto_phase is not None: q = q.filter(GameEvent.phase_number <= upto_phase)
+    n = 0
+    for ev in q.order_by(GameEvent.seq):
+        apply_event(state, ev.kind, ev.payload, ev.phase_number); seq = ev.seq; n += 1
+    if not snap and not n: return None, 0, 0
+    return state, seq, n
+
+def last_seq(db, game_id: int) -> int:
+    return db.query(func.coalesce(func.max(GameEvent.seq), 0)).filter(GameEvent.game_id==game_id).scalar()
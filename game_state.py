@@ -0,0 +1,381 @@
+from __future__ import annotations
+import json, logging, threading, time
+from collections import Counter
+from datetime import datetime
+from typing import Dict, List, Optional
+from sqlalchemy import update
+from sqlalchemy.exc import IntegrityError, DataError
+from models import Game, Phase, PlayerState, Role, Action, User, GameEvent, GameSnapshot, upsert
+from game_journal import Journal, replay
+from role_rules import KILLER_KEYS, night_actors
+
+log = logging.getLogger(__name__)
+
+try:
+    from eventlet.semaphore import Semaphore as _Semaphore   # 按 greenthread 互斥（threading 锁在同一线程的 greenthread 间不互斥）
+except ImportError: from threading import Semaphore as _Semaphore
+
+# 内存中的权威对局状态：handler 直接读写这里，数据库由 WriteBehind 异步批量落盘。
+# 重启后可通过 GameState.load 从数据库重建。
+
+class PlayerSlot:
+    __slots__ = ("user_id", "role_id", "role_key", "camp", "alive", "meta", "nickname")
+    def __init__(self, user_id, role_id, role_key, camp, alive=True, meta=None, nickname=""):
+        self.user_id = user_id; self.role_id = role_id; self.role_key = role_key
+        self.camp = camp; self.alive = alive; self.meta = meta or {}; self.nickname = nickname
+
+class ActionSlot:
+    # 属性名与 models.Action 保持一致，resolver 可以直接使用
+    __slots__ = ("actor_user_id", "type", "target_user_id", "meta")
+    def __init__(self, actor_user_id, type, target_user_id=None, meta=None):
+        self.actor_user_id = actor_user_id; self.type = type
+        self.target_user_id = target_user_id; self.meta = meta or {}
+
+WOLF_ROLES = set(KILLER_KEYS)
+# 夜间必须行动的身份由 role_rules 中注册的规则决定
+NIGHT_ROLES = night_actors()
+FIRST_NIGHT_ROLES = night_actors(first_night=True)
+
+class PhaseTally:
+    # 阶段内增量统计：狼刀计数、白天加权票数、尚未行动的必需玩家。每次更新 O(1)
+    __slots__ = ("wolf_votes", "votes", "pending", "_counted")
+    def __init__(self, pending):
+        self.wolf_votes = Counter(); self.votes = Counter()
+        self.pending = set(pending)
+        self._counted = {}   # actor -> (counter, target, weight)，改票时原地撤销
+
+    @classmethod
+    def for_phase(cls, phase: Phase, players: Dict[int, "PlayerSlot"]) -> "PhaseTally":
+        if phase.type == "night":
+            night = FIRST_NIGHT_ROLES if phase.number == 1 else NIGHT_ROLES
+            return cls(uid for uid, p in players.items() if p.alive and p.role_key in night)
+        return cls(uid for uid, p in players.items() if p.alive)
+
+    def update(self, actor: int, type_: str, target: Optional[int], role_key: Optional[str] = None):
+        prev = self._counted.pop(actor, None)
+        if prev:
+            c, t, w = prev
+            c[t] -= w
+            if c[t] <= 0: del c[t]
+        # 狼刀只计刀人阵营身份（与 WolfKillRule 一致）；村长白天一票算两票
+        weight = 2 if role_key == "village_head" else 1
+        c = (self.wolf_votes if type_ == "wolf_kill" and role_key in WOLF_ROLES else
+             self.votes if type_ == "day_vote" else None)
+        if c is not None and target:
+            c[target] += weight
+            self._counted[actor] = (c, target, weight)
+        self.pending.discard(actor)
+
+    @property
+    def complete(self) -> bool: return not self.pending
+
+class WinTracker:
+    # 胜负增量统计：各阵营存活数、情侣、未被魅惑的存活者，只在死亡/meta 变化时更新，判定 O(1)
+    __slots__ = ("alive", "lovers", "lovers_alive", "uncharmed", "pipers", "angels", "_camp", "_charmed")
+    def __init__(self, players: Dict[int, "PlayerSlot"]):
+        self.alive = Counter(); self._camp = {}; self._charmed = set()
+        self.lovers = None; self.lovers_alive = 0
+        self.uncharmed = 0; self.pipers = 0; self.angels = 0   # 未被魅惑的存活者 / 存活吹笛者 / 存活天使
+        for uid, p in players.items():
+            self._camp[uid] = p.meta.get("camp") or p.camp
+            if p.meta.get("charmed"): self._charmed.add(uid)
+            if p.meta.get("lover"): self.lovers = frozenset((uid, p.meta["lover"]))
+            if not p.alive: continue
+            self.alive[self._camp[uid]] += 1
+            if p.role_key == "angel": self.angels += 1
+            if p.role_key == "piper": self.pipers += 1
+            elif uid not in self._charmed: self.uncharmed += 1
+        if self.lovers: self.lovers_alive = sum(1 for u in self.lovers if players.get(u) and players[u].alive)
+
+    def update(self, players: Dict[int, "PlayerSlot"], died, touched):
+        # 先处理 meta 变化（此时本次死亡者仍按存活计），再处理死亡
+        died_now = set(died)
+        for uid in touched:
+            p = players[uid]; was_alive = p.alive or uid in died_now
+            if p.meta.get("charmed") and uid not in self._charmed:
+                self._charmed.add(uid)
+                if was_alive and p.role_key != "piper": self.uncharmed -= 1
+            if p.meta.get("lover") and not self.lovers:
+                self.lovers = frozenset((uid, p.meta["lover"]))
+                self.lovers_alive = sum(1 for u in self.lovers if players.get(u) and (players[u].alive or u in died_now))
+            camp = p.meta.get("camp") or p.camp
+            if camp != self._camp[uid]:
+                if was_alive: self.alive[self._camp[uid]] -= 1; self.alive[camp] += 1
+                self._camp[uid] = camp
+        for uid in died:
+            p = players[uid]
+            self.alive[self._camp[uid]] -= 1
+            if p.role_key == "angel": self.angels -= 1
+            if p.role_key == "piper": self.pipers -= 1
+            elif uid not in self._charmed: self.uncharmed -= 1
+            if self.lovers and uid in self.lovers: self.lovers_alive -= 1
+
+    def winner(self, phase: Phase, summary: dict) -> Optional[str]:
+        # 优先级：小丑 > 天使 > 情侣 > 吹笛者 > 好人/狼人
+        if summary.get("win"): return summary["win"]
+        if self.angels and phase.type == "day" and phase.number == 2: return "angel"   # 天使活过第 1 天
+        total = sum(self.alive.values())
+        if self.lovers and self.lovers_alive == 2 and total == 2: return "lovers"
+        if self.pipers and not self.uncharmed: return "piper"
+        wolves = self.alive["werewolf"]
+        if not wolves: return "villager"
+        if wolves >= total - wolves: return "werewolf"
+        return None
+
+class GameState:
+    __slots__ = ("game_id", "room_id", "phase", "players", "actions", "tally", "wins", "lock", "version", "_snapshot", "loaded_at")
+    def __init__(self, game_id: int, room_id: int):
+        self.game_id = game_id; self.room_id = room_id
+        self.phase: Optional[Phase] = None
+        self.players: Dict[int, PlayerSlot] = {}
+        self.actions: Dict[int, ActionSlot] = {}   # 当前阶段 actor_user_id -> action
+        self.tally: Optional[PhaseTally] = None
+        self.wins: Optional[WinTracker] = None
+        self.lock = _Semaphore(1)   # 不可重入：持锁期间数据库查询会让出 hub，其他投票在此排队
+        # 死亡/换阶段时递增；以毫秒时间戳起步，进程重启重建后也不会与旧 ETag 冲突
+        self.version = int(time.time() * 1000)
+        self._snapshot = None
+        self.loaded_at = time.monotonic()
+
+    @classmethod
+    def load(cls, db, room_id: int, journal: Optional[Journal] = None) -> Optional["GameState"]:
+        game = db.query(Game).filter_by(room_id=room_id, finished=False).first()
+        if not game: return None
+        st = cls(game.id, room_id)
+        st.phase = db.query(Phase).filter_by(game_id=game.id).order_by(Phase.number.desc()).first()
+        # 优先用日志重建（最近快照 + 之后的事件）；日志缺失或落后于 phases 表时退回按表加载
+        state, seq, n = replay(db, game.id)
+        if state and state["players"] and st.phase and (state["phase"] or {}).get("number") == st.phase.number:
+            for uid, (role_id, key, camp, alive, meta, nickname) in state["players"].items():
+                st.players[int(uid)] = PlayerSlot(int(uid), role_id, key, camp, alive, dict(meta or {}), nickname)
+            st.tally = PhaseTally.for_phase(st.phase, st.players)
+            st.wins = WinTracker(st.players)
+            for actor, (type_, target, meta) in state["actions"].items():
+                st.record_action(int(actor), type_, target, meta)
+            if journal: journal.seed(game.id, seq, n)
+            return st
+        rows = (db.query(PlayerState, Role.key, Role.camp, User.nickname).join(Role, Role.id==PlayerState.role_id)
+                .join(User, User.id==PlayerState.user_id).filter(PlayerState.game_id==game.id).order_by(PlayerState.id).all())
+        for ps, key, camp, nickname in rows:
+            st.players[ps.user_id] = PlayerSlot(ps.user_id, ps.role_id, key, camp, ps.alive, dict(ps.meta or {}), nickname)
+        st.wins = WinTracker(st.players)
+        if st.phase:
+            st.tally = PhaseTally.for_phase(st.phase, st.players)
+            for a in db.query(Action).filter_by(game_id=game.id, phase_number=st.phase.number).all():
+                st.record_action(a.actor_user_id, a.type, a.target_user_id)
+        if journal and seq == 0:
+            # 新开局（或旧版对局）首次加载：以当前状态作为日志起点
+            journal.seed(game.id, 0)
+            journal.append(game.id, "game_started", {"room_id": room_id, "players": st.journal_state()["players"]}, 0)
+            if st.phase: journal.append(game.id, "phase_opened", st.journal_phase(), st.phase.number)
+            for a in st.actions.values():
+                journal.append(game.id, "action_submitted", {"actor": a.actor_user_id, "type": a.type,
+                                                             "target": a.target_user_id, "meta": a.meta}, st.phase.number)
+        elif journal: journal.seed(game.id, seq, n)
+        return st
+
+    @property
+    def phase_type(self) -> Optional[str]: return self.phase.type if self.phase else None
+
+    def is_alive(self, user_id: int) -> bool:
+        p = self.players.get(user_id)
+        return bool(p and p.alive)
+
+    def duel_wins(self, actor: int, target: Optional[int]) -> bool:
+        # 骑士决斗命中狼人：白天立即结算（与 role_rules.KnightRule 的判定一致）
+        p, t = self.players.get(actor), self.players.get(target)
+        return bool(p and p.alive and p.role_key == "knight" and not p.meta.get("duel_used")
+                    and t and t.alive and t.role_key in WOLF_ROLES)
+
+    def record_action(self, actor: int, type_: str, target: Optional[int], meta=None) -> ActionSlot:
+        a = self.actions.get(actor)
+        if a is None:
+            a = self.actions[actor] = ActionSlot(actor, type_, target, meta)
+        else:
+            a.type = type_; a.target_user_id = target; a.meta = meta or {}
+        p = self.players.get(actor)
+        self.tally.update(actor, type_, target, p.role_key if p else None)
+        return a
+
+    def phase_actions(self) -> List[ActionSlot]: return list(self.actions.values())
+
+    def open_phase(self, phase: Phase):
+        self.phase = phase; self.actions = {}
+        self.tally = PhaseTally.for_phase(phase, self.players)
+        self.bump()
+
+    def bump(self):
+        self.version += 1; self._snapshot = None
+
+    def snapshot(self) -> str:
+        # 所有观众共享的公开部分（阶段、倒计时、玩家列表），按版本缓存为 JSON 字符串
+        snap = self._snapshot
+        if snap is None or snap[0] != self.version:
+            ph = self.phase
+            body = json.dumps({"phase": ph.type if ph else "night",
+                               "deadline": ph.ends_at.isoformat() if ph and ph.ends_at else None,
+                               "players": [{"id": p.user_id, "nickname": p.nickname, "alive": p.alive} for p in self.players.values()]},
+                              ensure_ascii=False, separators=(",", ":"))
+            snap = self._snapshot = (self.version, body)
+        return snap[1]
+
+    def role_map(self) -> dict:
+        # 供 role_effects 结算使用的快照，无需再查库；meta 复制一份以便结算后比对变化
+        return {uid: (p.role_key, p.camp, p.alive, dict(p.meta)) for uid, p in self.players.items()}
+
+    def apply_role_map(self, roles: dict):
+        # 返回 (本次死亡的玩家, meta 有变化的玩家)
+        died, touched = [], []
+        for uid, (_, _, alive, meta) in roles.items():
+            p = self.players.get(uid)
+            if not p: continue
+            if p.alive and not alive: died.append(uid)
+            if p.meta != meta: touched.append(uid)
+            p.alive = alive; p.meta = meta
+        if self.wins and (died or touched): self.wins.update(self.players, died, touched)
+        if died: self.bump()
+        return died, touched
+
+    def journal_phase(self) -> dict:
+        ph = self.phase
+        return {"id": ph.id, "number": ph.number, "type": ph.type, "ends_at": ph.ends_at.isoformat() if ph.ends_at else None}
+
+    def journal_state(self) -> dict:
+        return {"room_id": self.room_id, "phase": self.journal_phase() if self.phase else None,
+                "players": {str(uid): [p.role_id, p.role_key, p.camp, p.alive, p.meta, p.nickname] for uid, p in self.players.items()},
+                "actions": {str(a.actor_user_id): [a.type, a.target_user_id, a.meta] for a in self.actions.values()},
+                "effects": {}}
+
+class WriteBehind:
+    # 把行动写入缓冲，按 (game, phase, actor) 合并后批量落盘
+    def __init__(self, session_factory, interval: float = 0.2):
+        self.session_factory = session_factory; self.interval = interval
+        self._actions = {}
+        self._events = []; self._snapshots = []
+        self._lock = threading.Lock()
+        # 同一时间只有一个 flush：后台循环、统计、截止处理都会调用，数据库调用让出 hub 时
+        # 较早的批次可能晚于较新的批次提交，用旧行动覆盖同一 (对局, 阶段, 玩家) 的新行动
+        self._flushing = _Semaphore(1)
+
+    def put_event(self, row: dict):
+        with self._lock: self._events.append(row)
+
+    def put_snapshot(self, row: dict):
+        with self._lock: self._snapshots.append(row)
+
+    def put_action(self, game_id: int, phase_number: int, a: ActionSlot):
+        with self._lock:
+            self._actions[(game_id, phase_number, a.actor_user_id)] = (a.type, a.target_user_id)
+
+    def flush(self):
+        with self._flushing: return self._flush()
+
+    def _flush(self):
+        with self._lock:
+            pending, self._actions = self._actions, {}
+            events, self._events = self._events, []
+            snapshots, self._snapshots = self._snapshots, []
+        if not (pending or events or snapshots): return 0
+        db = self.session_factory()
+        try:
+            self._write(db, pending, events, snapshots)
+            db.commit()
+            return len(pending) + len(events) + len(snapshots)
+        except (IntegrityError, DataError):
+            # 批内有坏行：逐行重写，坏行丢弃并记日志，不让一行数据卡住整个进程的落盘
+            db.rollback()
+            return self._write_rows(db, pending, events, snapshots)
+        except Exception:
+            db.rollback(); self._requeue(pending, events, snapshots)
+            raise
+        finally: db.close()
+
+    def _write(self, db, pending: dict, events: list, snapshots: list):
+        # 行动：一条 INSERT ... ON CONFLICT (game_id, phase_number, actor_user_id) DO UPDATE
+        if pending:
+            rows = [{"game_id": g, "phase_number": n, "actor_user_id": actor, "type": type_, "target_user_id": target,
+                     "created_at": datetime.utcnow()} for (g, n, actor), (type_, target) in pending.items()]
+            upsert(db, Action, rows, ["game_id", "phase_number", "actor_user_id"], ["type", "target_user_id"])
+        # 日志事件与快照同一事务批量插入，与 actions 表保持一致
+        if events: db.execute(GameEvent.__table__.insert(), events)
+        if snapshots: db.execute(GameSnapshot.__table__.insert(), snapshots)
+
+    def _write_rows(self, db, pending: dict, events: list, snapshots: list) -> int:
+        items = [({k: v}, [], []) for k, v in pending.items()] + [({}, [e], []) for e in events] + [({}, [], [s]) for s in snapshots]
+        n = 0
+        for i, (p, e, s) in enumerate(items):
+            try:
+                self._write(db, p, e, s); db.commit(); n += 1
+            except (IntegrityError, DataError) as err:
+                db.rollback()
+                log.error("write-behind dropped row %r: %s", p or e or s, err.orig)
+            except Exception:
+                # 数据库不可用等：剩余的行放回缓冲，下次重试
+                db.rollback()
+                rest = items[i:]
+                self._requeue({k: v for p, _, _ in rest for k, v in p.items()}, [x for _, e, _ in rest for x in e],
+                              [x for _, _, s in rest for x in s])
+                raise
+        return n
+
+    def _requeue(self, pending: dict, events: list, snapshots: list):
+        with self._lock:  # 放回缓冲，保留更新的写入
+            for k, v in pending.items(): self._actions.setdefault(k, v)
+            self._events[:0] = events; self._snapshots[:0] = snapshots
+
+    def run(self, sleep):
+        while True:
+            sleep(self.interval)
+            try: self.flush()
+            except Exception: log.exception("write-behind flush failed")
+
+class GameStore:
+    def __init__(self, session_factory):
+        self._games: Dict[int, GameState] = {}
+        self._lock = threading.Lock()
+        self.writer = WriteBehind(session_factory)
+        self.journal = Journal(self.writer)
+
+    def get(self, db, room_id: int, max_age: Optional[float] = None) -> Optional[GameState]:
+        # max_age：分片模式下本进程不持有的房间只做短时只读缓存，过期即从库重新加载（不写日志）
+        st = self._games.get(room_id)
+        if st is not None and (max_age is None or time.monotonic() - st.loaded_at <= max_age): return st
+        fresh = GameState.load(db, room_id, self.journal if max_age is None else None)
+        with self._lock:
+            if fresh is None: self._games.pop(room_id, None); return None
+            if st is None: return self._games.setdefault(room_id, fresh)
+            self._games[room_id] = fresh
+            return fresh
+
+    def reset(self, room_id: int):
+        # 开新局/结束时丢弃旧状态，下次访问重新加载
+        with self._lock: self._games.pop(room_id, None)
+
+    def record_action(self, st: GameState, actor: int, type_: str, target: Optional[int], meta=None) -> ActionSlot:
+        a = st.record_action(actor, type_, target, meta)
+        self.writer.put_action(st.game_id, st.phase.number, a)
+        self.journal.append(st.game_id, "action_submitted", {"actor": actor, "type": type_, "target": target, "meta": a.meta}, st.phase.number)
+        return a
+
+    def record_resolution(self, st: GameState, summary: dict, died, touched, cause: str):
+        # 结算结果（含情侣/魅惑等效果）与死亡写入日志
+        n = st.phase.number
+        for uid in died: self.journal.append(st.game_id, "player_died", {"user_id": uid, "cause": cause}, n)
+        for uid in touched: self.journal.append(st.game_id, "meta_changed", {"user_id": uid, "meta": st.players[uid].meta}, n)
+        self.journal.append(st.game_id, "role_effect", summary, n)
+
+    def finish(self, db, st: GameState, winner: str):
+        # 结束对局：写入胜方，日志记一条 game_over 后不再追加
+        db.execute(update(Game).where(Game.id==st.game_id, Game.finished==False)
+                   .values(finished=True, winner=winner, finished_at=datetime.utcnow()))
+        db.commit()
+        self.journal.append(st.game_id, "game_over", {"winner": winner}, st.phase.number)
+        self.journal.forget(st.game_id)
+        self.reset(st.room_id)
+
+    def open_phase(self, st: GameState, phase: Phase):
+        st.open_phase(phase)
+        self.journal.append(st.game_id, "phase_opened", st.journal_phase(), phase.number)
+        self.journal.maybe_snapshot(st.game_id, st.journal_state, phase.number)
+
+    def __len__(self): return len(self._games)
@@ -0,0 +1,311 @@
+from __future__ import annotations
+# 端到端压测：通过 HTTP 注册/登录机器人、在大厅建房并开局，再用真实的 Socket.IO 连接
+# 发送与 room.html 相同的事件打完对局，统计事件往返延迟分位数、丢失事件数和服务端 CPU/内存。
+#   python loadgen.py --spawn --rooms 20 --players 8                      # 本地启动 app.py（SQLite）后压测
+#   python loadgen.py --spawn --db postgresql+psycopg2://localhost/werewolf_load --rooms 100
+#   python loadgen.py --url http://127.0.0.1:5000 --server-pid 12345 --rooms 50
+# 依赖：pip install requests websocket-client（msgpack 可选，配合 --msgpack）
+import argparse, json, os, random, re, subprocess, sys, threading, time
+from collections import defaultdict
+from datetime import datetime
+
+import requests
+import socketio
+
+from bench import MIXES, parse_mix, percentiles
+from game_engine import ROLE_LIBRARY
+from game_state import WOLF_ROLES, NIGHT_ROLES, FIRST_NIGHT_ROLES
+
+try: import msgpack
+except ImportError: msgpack = None
+
+CSRF_RE = re.compile(r'name="csrf_token" type="hidden" value="([^"]+)"')
+ROLE_INPUT_RE = re.compile(r'</strong>\s*([^<—]+?)\s*—.*?name="role_(\d+)"', re.S)
+NIGHT_MOVES = {"seer": "seer_peek", "guardian": "guardian_protect", "raven": "raven_mark"}
+
+class Stats:
+    def __init__(self):
+        self.samples = defaultdict(list)      # 指标名 -> 秒
+        self.counts = defaultdict(int)
+        self._lock = threading.Lock()
+
+    def add(self, name: str, v: float):
+        with self._lock: self.samples[name].append(v)
+
+    def inc(self, name: str, n: int = 1):
+        with self._lock: self.counts[name] += n
+
+def csrf(html: str) -> str:
+    m = CSRF_RE.search(html)
+    return m.group(1) if m else ""
+
+def login(base: str, email: str, nickname: str, stats: Stats) -> requests.Session:
+    s = requests.Session()
+    t = time.perf_counter()
+    r = s.get(f"{base}/register")
+    s.post(f"{base}/register", data={"csrf_token": csrf(r.text), "email": email, "nickname": nickname,
+                                     "password": "loadgen-pw", "confirm": "loadgen-pw"})   # 已注册时返回提示页，忽略
+    r = s.get(f"{base}/login")
+    r = s.post(f"{base}/login", data={"csrf_token": csrf(r.text), "email": email, "password": "loadgen-pw"},
+               allow_redirects=False)
+    if r.status_code != 302: raise RuntimeError(f"login failed for {email}: {r.status_code}")
+    stats.add("http_login", time.perf_counter() - t)
+    return s
+
+class Bot:
+    # 一个玩家：一个 HTTP 会话 + 一条 Socket.IO 连接，按收到的事件行动
+    def __init__(self, room: "RoomRun", session: requests.Session, nickname: str):
+        self.room = room; self.session = session; self.nickname = nickname
+        self.user_id = None; self.role_key = None; self.wolves = []
+        self.first_phase = None               # 开局时身份尚未送达，收到 private 后再行动
+        self.pending_ok = {}                  # 已发出、等待 action_ok 的夜间行动 -> 发送时间
+        self.sio = socketio.Client(reconnection=False)
+        self.joined = threading.Event()
+        for ev in ("joined", "game_started", "phase_change", "private", "action_ok", "game_over"):
+            self.sio.on(ev, getattr(self, "_on_" + ev))
+
+    def connect(self, transport: str):
+        cookie = "; ".join(f"{k}={v}" for k, v in self.session.cookies.items())
+        self.sio.connect(self.room.base, headers={"Cookie": cookie}, transports=[transport], wait_timeout=10)
+        self.join()
+
+    def join(self):
+        self.sio.emit("join_room", {"room_id": self.room.room_id, "codec": self.room.codec})
+
+    def _dec(self, d): return msgpack.unpackb(d) if isinstance(d, (bytes, bytearray)) else d
+
+    def _on_joined(self, d): self.joined.set()
+
+    def _on_game_started(self, d):
+        d = self._dec(d)
+        for uid, nickname, _ in d["players"]:
+            if nickname == self.nickname: self.user_id = uid
+        self.join()                           # 与 room.html 一样，开局后重新加入以进入身份子房间
+        self.first_phase = (d["phase"], d["n"], [p[0] for p in d["players"]])
+        if self.role_key: self._start()
+
+    def _start(self):
+        phase, n, players = self.first_phase; self.first_phase = None
+        self.room.on_phase(self, phase, n, players, [])
+
+    def _on_phase_change(self, d):
+        d = self._dec(d)
+        self.room.on_phase(self, d["phase"], d["n"], None, d["dead"])
+        if self.user_id in d["dead"]: self.join()
+
+    def _on_private(self, d):
+        d = self._dec(d)
+        if d.get("wolves"): self.wolves = d["wolves"]
+        if d.get("role_key"):
+            self.role_key = d["role_key"]
+            if self.first_phase: self._start()
+
+    def _on_game_over(self, d):
+        self.room.on_game_over(self._dec(d))
+
+    def _on_action_ok(self, d):
+        t = self.pending_ok.pop(d.get("action"), None)
+        if t is not None: self.room.stats.add("night_action_ok", time.perf_counter() - t)
+
+    def act(self, phase: str, alive: list, rng: random.Random):
+        if self.user_id not in alive: return
+        others = [u for u in alive if u != self.user_id] or alive
+        if phase == "night":
+            rk = self.role_key
+            if rk in WOLF_ROLES:
+                # 狼人统一刀存活的非狼玩家中 id 最小者，保证对局推进
+                prey = [u for u in alive if u not in self.wolves] or others
+                action, target = "wolf_kill", min(prey)
+            elif rk in NIGHT_MOVES: action, target = NIGHT_MOVES[rk], rng.choice(others)
+            elif rk in (FIRST_NIGHT_ROLES if self.room.phase_n == 1 else NIGHT_ROLES): action, target = "skip", None
+            else: return
+            self.pending_ok[action] = time.perf_counter()
+            self.room.sent(self)
+            self.sio.emit("night_action", {"room_id": self.room.room_id, "action": action, "target_user_id": target})
+        else:
+            self.room.sent(self)
+            self.sio.emit("day_vote", {"room_id": self.room.room_id, "action": "day_vote", "target_user_id": rng.choice(others)})
+
+class RoomRun:
+    def __init__(self, base: str, index: int, args, stats: Stats, role_ids: dict):
+        self.base = base; self.index = index; self.args = args; self.stats = stats; self.role_ids = role_ids
+        self.codec = "msgpack" if args.msgpack else "json"
+        self.room_id = None; self.bots = []
+        self.rng = random.Random(args.seed + index)
+        self.alive = []; self.phase_n = 0; self.winner = None
+        self.received = defaultdict(int)      # 阶段序号 -> 收到 phase_change 的客户端数
+        self.last_sent = {}                   # 阶段序号 -> 本阶段最后一次行动的发送时间
+        self.done = threading.Event()
+        self._lock = threading.Lock()
+
+    def sent(self, bot):
+        with self._lock: self.last_sent[self.phase_n] = time.perf_counter()
+
+    def on_phase(self, bot: Bot, phase: str, n: int, players, dead):
+        now = time.perf_counter()
+        with self._lock:
+            self.received[n] += 1
+            first = n > self.phase_n
+            if first:
+                if n > 1 and n - 1 in self.last_sent: self.stats.add("phase_change", now - self.last_sent[n - 1])
+                self.phase_n = n
+                if players is not None: self.alive = list(players)
+                self.alive = [u for u in self.alive if u not in dead]
+            alive = list(self.alive)
+        if n > self.args.max_phases or len(alive) <= 2:
+            self.done.set(); return
+        bot.act(phase, alive, self.rng)
+
+    def on_game_over(self, d):
+        with self._lock:
+            if self.winner is None: self.winner = d["winner"]; self.stats.inc("winner_" + d["winner"])
+        self.done.set()
+
+    def run(self):
+        a = self.args
+        try:
+            sessions = [login(self.base, f"lg{self.index}-{i}@loadgen.io", f"lg{self.index}-{i}", self.stats) for i in range(a.players)]
+            owner = sessions[0]
+            r = owner.get(f"{self.base}/lobby")
+            mix = parse_mix(a.mix, a.players, self.rng)
+            data = {"csrf_token": csrf(r.text), "name": f"load-{self.index}", "max_players": a.players}
+            data.update({f"role_{self.role_ids[k]}": n for k, n in mix.items() if k in self.role_ids})
+            r = owner.post(f"{self.base}/lobby", data=data, allow_redirects=False)
+            self.room_id = int(r.headers["Location"].rstrip("/").rsplit("/", 1)[1])
+            for s in sessions[1:]: s.get(f"{self.base}/room/{self.room_id}")
+            self.bots = [Bot(self, s, f"lg{self.index}-{i}") for i, s in enumerate(sessions)]
+            for b in self.bots:
+                t = time.perf_counter(); b.connect(a.transport)
+                if not b.joined.wait(10): self.stats.inc("dropped_joined")
+                else: self.stats.add("socket_join", time.perf_counter() - t)
+            t = time.perf_counter()
+            owner.post(f"{self.base}/start/{self.room_id}", allow_redirects=False)
+            self.stats.add("http_start", time.perf_counter() - t)
+            if not self.done.wait(a.game_timeout): self.stats.inc("games_timed_out")
+            else: self.stats.inc("games_completed")
+            time.sleep(0.5)                   # 等待最后一批推送到齐
+        except Exception as e:
+            self.stats.inc("room_errors"); print(f"room {self.index}: {e!r}", file=sys.stderr)
+        finally:
+            self.finish()
+
+    def finish(self):
+        # 每个已开始的阶段都应被所有连接收到一次，少收的计为丢失
+        n_bots = len(self.bots)
+        for n in range(1, self.phase_n + 1):
+            self.stats.inc("dropped_phase_change", max(0, n_bots - self.received.get(n, 0)))
+        self.stats.inc("phases", self.phase_n)
+        for b in self.bots:
+            self.stats.inc("dropped_action_ok", len(b.pending_ok))
+            try: b.sio.disconnect()
+            except Exception: pass
+
+class ProcessSampler:
+    # 每秒采样服务端进程 CPU 与 RSS；有 psutil 时使用 psutil，否则读取 /proc
+    def __init__(self, pid: int, interval: float = 1.0):
+        self.pid = pid; self.interval = interval
+        self.cpu = []; self.rss = []
+        self._stop = threading.Event()
+        try:
+            import psutil
+            self._proc = psutil.Process(pid); self._proc.cpu_percent(None)
+        except ImportError: self._proc = None
+
+    def _read(self):
+        if self._proc is not None:
+            return self._proc.cpu_percent(None), self._proc.memory_info().rss
+        with open(f"/proc/{self.pid}/stat") as f: fields = f.read().rsplit(")", 1)[1].split()
+        ticks = int(fields[11]) + int(fields[12])
+        with open(f"/proc/{self.pid}/statm") as f: rss = int(f.read().split()[1]) * os.sysconf("SC_PAGE_SIZE")
+        now = time.monotonic(); prev = getattr(self, "_prev", None); self._prev = (now, ticks)
+        if prev is None: return None, rss
+        return (ticks - prev[1]) / os.sysconf("SC_CLK_TCK") / (now - prev[0]) * 100, rss
+
+    def run(self):
+        while not self._stop.wait(self.interval):
+            try: cpu, rss = self._read()
+            except (OSError, Exception): return
+            if cpu is not None: self.cpu.append(cpu)
+            self.rss.append(rss)
+
+    def stop(self) -> dict:
+        self._stop.set()
+        if not self.rss: return {}
+        return {"cpu_avg_pct": round(sum(self.cpu) / max(1, len(self.cpu)), 1), "cpu_max_pct": round(max(self.cpu or [0]), 1),
+                "rss_max_mb": round(max(self.rss) / 2**20, 1), "rss_end_mb": round(self.rss[-1] / 2**20, 1)}
+
+def spawn_server(args):
+    env = dict(os.environ, PORT=str(args.port), DATABASE_URL=args.db)
+    proc = subprocess.Popen([sys.executable, os.path.join(os.path.dirname(os.path.abspath(__file__)), "app.py")], env=env)
+    base = f"http://127.0.0.1:{args.port}"
+    for _ in range(100):
+        try: requests.get(base + "/", timeout=1); return proc, base
+        except requests.RequestException: time.sleep(0.2)
+        if proc.poll() is not None: break
+    proc.terminate(); raise SystemExit("server did not start")
+
+def role_ids_from_lobby(base: str, stats: Stats) -> dict:
+    # 大厅页面只显示角色中文名，按 ROLE_LIBRARY 反查 key
+    s = login(base, "lg-admin@loadgen.io", "lg-admin", stats)
+    by_name = {name: key for key, (name, _, _) in ROLE_LIBRARY.items()}
+    return {by_name[name]: int(rid) for name, rid in ROLE_INPUT_RE.findall(s.get(f"{base}/lobby").text) if name in by_name}
+
+def run(args) -> dict:
+    proc, base = spawn_server(args) if args.spawn else (None, args.url.rstrip("/"))
+    pid = proc.pid if proc else args.server_pid
+    sampler = ProcessSampler(pid) if pid else None
+    stats = Stats()
+    try:
+        role_ids = role_ids_from_lobby(base, stats)
+        if sampler: threading.Thread(target=sampler.run, daemon=True).start()
+        rooms = [RoomRun(base, i, args, stats, role_ids) for i in range(args.rooms)]
+        threads = []
+        t0 = time.perf_counter()
+        for r in rooms:
+            th = threading.Thread(target=r.run, daemon=True); th.start(); threads.append(th)
+            time.sleep(args.ramp)
+        for th in threads: th.join()
+        elapsed = time.perf_counter() - t0
+    finally:
+        server = sampler.stop() if sampler else {}
+        if proc: proc.terminate(); proc.wait(10)
+    c = stats.counts
+    return {
+        "meta": {"url": base, "rooms": args.rooms, "players": args.players, "mix": args.mix, "codec": "msgpack" if args.msgpack else "json",
+                 "transport": args.transport, "created_at": datetime.utcnow().isoformat()},
+        "elapsed_s": round(elapsed, 2),
+        "games_completed": c["games_completed"], "games_timed_out": c["games_timed_out"], "room_errors": c["room_errors"],
+        "phases": c["phases"],
+        "dropped": {k[len("dropped_"):]: v for k, v in c.items() if k.startswith("dropped_")},
+        "winners": {k[len("winner_"):]: v for k, v in c.items() if k.startswith("winner_")},
+        "latency": {k: percentiles(v) for k, v in sorted(stats.samples.items())},
+        "server": server,
+    }
+
+def main(argv=None):
+    ap = argparse.ArgumentParser(description="Werewolf end-to-end Socket.IO load generator")
+    ap.add_argument("--url", default="http://127.0.0.1:5000")
+    ap.add_argument("--spawn", action="store_true", help="本地启动 app.py 并压测它")
+    ap.add_argument("--db", default="sqlite:///loadgen.sqlite", help="--spawn 时服务端使用的 DATABASE_URL")
+    ap.add_argument("--port", type=int, default=5055)
+    ap.add_argument("--server-pid", type=int, help="采样已运行服务端的 CPU/内存")
+    ap.add_argument("--rooms", type=int, default=10)
+    ap.add_argument("--players", type=int, default=8)
+    ap.add_argument("--mix", default="classic", help="classic|village|neutral|random 或 werewolf=3,seer=1,...")
+    ap.add_argument("--max-phases", type=int, default=12)
+    ap.add_argument("--game-timeout", type=float, default=300)
+    ap.add_argument("--ramp", type=float, default=0.1, help="相邻房间开始之间的间隔（秒）")
+    ap.add_argument("--transport", default="websocket", choices=["websocket", "polling"])
+    ap.add_argument("--msgpack", action="store_true")
+    ap.add_argument("--seed", type=int, default=42)
+    ap.add_argument("--save", help="把结果写入 JSON")
+    args = ap.parse_args(argv)
+    if args.msgpack and msgpack is None: raise SystemExit("--msgpack requires: pip install msgpack")
+    report = run(args)
+    print(json.dumps(report, indent=2, ensure_ascii=False))
+    if args.save:
+        with open(args.save, "w") as f: json.dump(report, f, indent=2, ensure_ascii=False)
+    return 1 if report["room_errors"] or report["games_timed_out"] else 0
+
+if __name__ == "__main__":
+    sys.exit(main())
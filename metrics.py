@@ -0,0 +1,160 @@
+from __future__ import annotations
+import logging, os, threading, time
+from bisect import bisect_left
+from functools import wraps
+from typing import Callable, Dict, Optional
+from sqlalchemy import event
+
+try:
+    from eventlet.corolocal import local as _local   # 每个 greenthread 独立的上下文
+except ImportError: from threading import local as _local
+
+log = logging.getLogger(__name__)
+
+# 进程内指标：HTTP 路由 / Socket.IO 事件 / 后台任务的耗时直方图，每个事件的 SQL 次数与数据库耗时，
+# 活跃房间、在线连接、eventlet hub 阻塞、连接池排队。GET /metrics 以 Prometheus 文本格式输出。
+
+LATENCY_BUCKETS = (.001, .0025, .005, .01, .025, .05, .1, .25, .5, 1, 2.5, 5, 10)
+QUERY_BUCKETS = (0, 1, 2, 3, 5, 8, 13, 21, 34, 55, 89)
+SLOW_EVENT_MS = float(os.getenv("SLOW_EVENT_MS", "250"))
+HUB_BLOCK_MS = float(os.getenv("HUB_BLOCK_MS", "50"))
+
+def _esc(v) -> str: return str(v).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+def _fmt(v) -> str: return "+Inf" if v == float("inf") else repr(float(v)) if isinstance(v, float) else str(v)
+
+class Histogram:
+    def __init__(self, name: str, help: str, label: str, buckets=LATENCY_BUCKETS):
+        self.name = name; self.help = help; self.label = label
+        self.buckets = tuple(buckets) + (float("inf"),)
+        self._series: Dict[str, list] = {}    # label -> [每个桶的计数..., sum, count]
+        self._lock = threading.Lock()
+
+    def observe(self, label: str, v: float):
+        i = bisect_left(self.buckets, v)
+        with self._lock:
+            s = self._series.get(label)
+            if s is None: s = self._series[label] = [0] * (len(self.buckets) + 2)
+            s[i] += 1; s[-2] += v; s[-1] += 1
+
+    def render(self):
+        yield f"# HELP {self.name} {self.help}"
+        yield f"# TYPE {self.name} histogram"
+        with self._lock: series = {k: list(v) for k, v in self._series.items()}
+        for label, s in sorted(series.items()):
+            lv = f'{self.label}="{_esc(label)}"'
+            acc = 0
+            for b, n in zip(self.buckets, s):
+                acc += n
+                yield f'{self.name}_bucket{{{lv},le="{_fmt(b)}"}} {acc}'
+            yield f"{self.name}_sum{{{lv}}} {s[-2]!r}"
+            yield f"{self.name}_count{{{lv}}} {s[-1]}"
+
+class Span:
+    __slots__ = ("kind", "name", "started", "queries", "db_seconds", "breakdown", "_q0")
+    def __init__(self, kind: str, name: str):
+        self.kind = kind; self.name = name; self.started = time.perf_counter()
+        self.queries = 0; self.db_seconds = 0.0
+        self.breakdown: Dict[str, list] = {}  # 语句摘要 -> [次数, 耗时]
+        self._q0 = None
+
+class Metrics:
+    def __init__(self):
+        self.latency = Histogram("werewolf_event_duration_seconds", "Latency per HTTP route / Socket.IO event / task", "event")
+        self.queries = Histogram("werewolf_event_db_queries", "SQL statements executed per event", "event", QUERY_BUCKETS)
+        self.db_time = Histogram("werewolf_event_db_seconds", "Database time per event", "event")
+        self.hub_lag = Histogram("werewolf_hub_lag_seconds", "Eventlet hub scheduling delay", "hub")
+        self.pool_wait = Histogram("werewolf_db_pool_wait_seconds", "Time spent queueing for a database connection", "pool")
+        self.counters: Dict[str, int] = {"werewolf_slow_events_total": 0, "werewolf_hub_blocked_total": 0,
+                                         "werewolf_db_queries_total": 0, "werewolf_db_pool_timeouts_total": 0}
+        self.gauges: Dict[str, Callable[[], float]] = {}
+        self.sockets = 0
+        self._local = _local()
+        self._lock = threading.Lock()
+
+    def _inc(self, name: str, n: int = 1):
+        with self._lock: self.counters[name] += n
+
+    # ---- 事件范围 ----
+    def begin(self, kind: str, name: str) -> Optional[Span]:
+        # 已在某个事件内（如单进程下 router 直接调用 handler）时不再嵌套计时
+        if getattr(self._local, "span", None) is not None: return None
+        span = self._local.span = Span(kind, name)
+        return span
+
+    def end(self, span: Optional[Span]):
+        if span is None: return
+        self._local.span = None
+        dt = time.perf_counter() - span.started
+        key = f"{span.kind}:{span.name}"
+        self.latency.observe(key, dt); self.queries.observe(key, span.queries); self.db_time.observe(key, span.db_seconds)
+        if span.queries: self._inc("werewolf_db_queries_total", span.queries)
+        if dt * 1000 >= SLOW_EVENT_MS:
+            self._inc("werewolf_slow_events_total")
+            top = sorted(span.breakdown.items(), key=lambda kv: -kv[1][1])[:5]
+            log.warning("slow %s %.1fms queries=%d db=%.1fms | %s", key, dt * 1000, span.queries, span.db_seconds * 1000,
+                        " ; ".join(f"{n}x {t * 1000:.1f}ms {stmt}" for stmt, (n, t) in top))
+
+    def timed(self, kind: str, name: str):
+        def deco(fn):
+            @wraps(fn)
+            def wrapper(*args, **kwargs):
+                span = self.begin(kind, name)
+                try: return fn(*args, **kwargs)
+                finally: self.end(span)
+            return wrapper
+        return deco
+
+    # ---- SQLAlchemy ----
+    def instrument_engine(self, engine):
+        @event.listens_for(engine, "before_cursor_execute")
+        def _before(conn, cursor, statement, parameters, context, executemany):
+            span = getattr(self._local, "span", None)
+            if span is not None: span._q0 = time.perf_counter()
+
+        @event.listens_for(engine, "after_cursor_execute")
+        def _after(conn, cursor, statement, parameters, context, executemany):
+            span = getattr(self._local, "span", None)
+            if span is None or span._q0 is None:
+                self._inc("werewolf_db_queries_total"); return
+            dt = time.perf_counter() - span._q0; span._q0 = None
+            span.queries += 1; span.db_seconds += dt
+            stmt = " ".join(statement.split())[:100]
+            b = span.breakdown.get(stmt)
+            if b is None: span.breakdown[stmt] = [1, dt]
+            else: b[0] += 1; b[1] += dt
+
+    def watch_pool(self, gate, name: str = "main"):
+        # database.PoolGate：排队耗时、超时次数，以及占用/排队/容量（占用 ÷ 容量即饱和度）
+        def on_wait(seconds: float, ok: bool):
+            self.pool_wait.observe(name, seconds)
+            if not ok: self._inc("werewolf_db_pool_timeouts_total")
+        gate.on_wait = on_wait
+        self.gauge("werewolf_db_pool_in_use", lambda: gate.in_use)
+        self.gauge("werewolf_db_pool_waiting", lambda: gate.waiting)
+        self.gauge("werewolf_db_pool_size", lambda: gate.size)
+
+    # ---- eventlet hub ----
+    def watch_hub(self, sleep, interval: float = 0.1):
+        # 定时 sleep，实际唤醒延迟即 hub 被同步代码阻塞的时间
+        while True:
+            t0 = time.perf_counter()
+            sleep(interval)
+            lag = max(0.0, time.perf_counter() - t0 - interval)
+            self.hub_lag.observe("main", lag)
+            if lag * 1000 >= HUB_BLOCK_MS:
+                self._inc("werewolf_hub_blocked_total")
+                log.warning("eventlet hub blocked for %.1fms", lag * 1000)
+
+    def gauge(self, name: str, fn: Callable[[], float]): self.gauges[name] = fn
+
+    def render(self) -> str:
+        lines = []
+        for h in (self.latency, self.queries, self.db_time, self.hub_lag, self.pool_wait): lines.extend(h.render())
+        with self._lock: counters = dict(self.counters)
+        for name, v in counters.items(): lines += [f"# TYPE {name} counter", f"{name} {v}"]
+        for name, fn in self.gauges.items():
+            try: v = fn()
+            except Exception: log.exception("gauge %s failed", name); continue
+            lines += [f"# TYPE {name} gauge", f"{name} {v}"]
+        return "\n".join(lines) + "\n"
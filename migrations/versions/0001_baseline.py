@@ -0,0 +1,88 @@
+"""baseline schema
+
+之前的数据库由 Base.metadata.create_all 建表，这里只补建缺失的表，
+已有库执行 upgrade 时不会报错。
+
+Revision ID: 0001
+Revises:
+Create Date: 2026-10-17 00:00:00
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = "0001"
+down_revision: Union[str, None] = None
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def _create(name, *cols):
+    if not sa.inspect(op.get_bind()).has_table(name):
+        op.create_table(name, *cols)
+
+
+def upgrade() -> None:
+    _create("users",
+            sa.Column("id", sa.Integer, primary_key=True),
+            sa.Column("email", sa.String(255), nullable=False, unique=True),
+            sa.Column("nickname", sa.String(64), nullable=False),
+            sa.Column("password_hash", sa.String(255), nullable=False),
+            sa.Column("created_at", sa.DateTime))
+    _create("rooms",
+            sa.Column("id", sa.Integer, primary_key=True),
+            sa.Column("name", sa.String(128), nullable=False),
+            sa.Column("owner_id", sa.Integer, sa.ForeignKey("users.id"), nullable=False),
+            sa.Column("max_players", sa.Integer),
+            sa.Column("created_at", sa.DateTime))
+    _create("memberships",
+            sa.Column("id", sa.Integer, primary_key=True),
+            sa.Column("user_id", sa.Integer, sa.ForeignKey("users.id"), nullable=False),
+            sa.Column("room_id", sa.Integer, sa.ForeignKey("rooms.id"), nullable=False))
+    _create("games",
+            sa.Column("id", sa.Integer, primary_key=True),
+            sa.Column("room_id", sa.Integer, sa.ForeignKey("rooms.id"), nullable=False),
+            sa.Column("created_at", sa.DateTime),
+            sa.Column("finished", sa.Boolean))
+    _create("phases",
+            sa.Column("id", sa.Integer, primary_key=True),
+            sa.Column("game_id", sa.Integer, sa.ForeignKey("games.id"), nullable=False),
+            sa.Column("number", sa.Integer, nullable=False),
+            sa.Column("type", sa.String(16), nullable=False),
+            sa.Column("ends_at", sa.DateTime, nullable=True))
+    _create("roles",
+            sa.Column("id", sa.Integer, primary_key=True),
+            sa.Column("key", sa.String(32), nullable=False, unique=True),
+            sa.Column("name", sa.String(64), nullable=False),
+            sa.Column("description", sa.String(255)),
+            sa.Column("camp", sa.String(16)))
+    _create("room_role_configs",
+            sa.Column("id", sa.Integer, primary_key=True),
+            sa.Column("room_id", sa.Integer, sa.ForeignKey("rooms.id"), nullable=False),
+            sa.Column("role_id", sa.Integer, sa.ForeignKey("roles.id"), nullable=False),
+            sa.Column("count", sa.Integer))
+    _create("player_states",
+            sa.Column("id", sa.Integer, primary_key=True),
+            sa.Column("game_id", sa.Integer, sa.ForeignKey("games.id"), nullable=False),
+            sa.Column("user_id", sa.Integer, sa.ForeignKey("users.id"), nullable=False),
+            sa.Column("role_id", sa.Integer, sa.ForeignKey("roles.id"), nullable=False),
+            sa.Column("alive", sa.Boolean),
+            sa.Column("meta", sa.JSON))
+    _create("actions",
+            sa.Column("id", sa.Integer, primary_key=True),
+            sa.Column("game_id", sa.Integer, sa.ForeignKey("games.id"), nullable=False),
+            sa.Column("phase_number", sa.Integer, nullable=False),
+            sa.Column("actor_user_id", sa.Integer, sa.ForeignKey("users.id"), nullable=False),
+            sa.Column("type", sa.String(32), nullable=False),
+            sa.Column("target_user_id", sa.Integer, sa.ForeignKey("users.id"), nullable=True),
+            sa.Column("created_at", sa.DateTime))
+
+
+def downgrade() -> None:
+    for name in ("actions", "player_states", "room_role_configs", "roles", "phases",
+                 "games", "memberships", "rooms", "users"):
+        op.drop_table(name)
@@ -0,0 +1,31 @@
+"""phases.resolved_at for deadline claiming
+
+可空列、无默认值，PostgreSQL 上只改元数据，不重写表。
+
+Revision ID: 0002
+Revises: 0001
+Create Date: 2026-10-17 00:00:01
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = "0002"
+down_revision: Union[str, None] = "0001"
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    cols = {c["name"] for c in sa.inspect(op.get_bind()).get_columns("phases")}
+    if "resolved_at" not in cols:
+        op.add_column("phases", sa.Column("resolved_at", sa.DateTime, nullable=True))
+
+
+def downgrade() -> None:
+    with op.batch_alter_table("phases") as batch:
+        batch.drop_column("resolved_at")
@@ -0,0 +1,77 @@
+"""hot-path indexes and uniqueness constraints
+
+先清理重复行，再建索引。PostgreSQL 上使用 CREATE INDEX CONCURRENTLY（autocommit 块内执行，
+不锁写），唯一索引建好后再 ADD CONSTRAINT ... USING INDEX，只需瞬时锁。
+
+Revision ID: 0003
+Revises: 0002
+Create Date: 2026-10-17 00:00:02
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = "0003"
+down_revision: Union[str, None] = "0002"
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+# (约束名, 表, 列, 重复时保留的行)
+UNIQUES = [
+    ("uq_actions_game_phase_actor", "actions", ["game_id", "phase_number", "actor_user_id"], "MAX"),
+    ("uq_player_states_game_user", "player_states", ["game_id", "user_id"], "MIN"),
+    ("uq_phases_game_number", "phases", ["game_id", "number"], "MIN"),
+    ("uq_memberships_room_user", "memberships", ["room_id", "user_id"], "MIN"),
+]
+
+
+def _pg():
+    return op.get_bind().dialect.name == "postgresql"
+
+
+def _create_index(name, table, cols, unique=False, where=None):
+    if _pg():
+        with op.get_context().autocommit_block():
+            op.create_index(name, table, cols, unique=unique, if_not_exists=True,
+                            postgresql_concurrently=True, postgresql_where=where)
+    else:
+        op.create_index(name, table, cols, unique=unique, if_not_exists=True, sqlite_where=where)
+
+
+def _drop_index(name, table):
+    if _pg():
+        with op.get_context().autocommit_block():
+            op.drop_index(name, table_name=table, if_exists=True, postgresql_concurrently=True)
+    else:
+        op.drop_index(name, table_name=table, if_exists=True)
+
+
+def upgrade() -> None:
+    # 一个房间只保留最新的进行中对局
+    op.execute(sa.text("UPDATE games SET finished = :t WHERE finished = :f AND id NOT IN "
+                       "(SELECT id FROM (SELECT MAX(id) AS id FROM games WHERE finished = :f GROUP BY room_id) AS keep)")
+               .bindparams(t=True, f=False))
+    for name, table, cols, keep in UNIQUES:
+        c = ", ".join(cols)
+        op.execute(f"DELETE FROM {table} WHERE id NOT IN (SELECT id FROM (SELECT {keep}(id) AS id FROM {table} GROUP BY {c}) AS keep)")
+    for name, table, cols, _ in UNIQUES:
+        _create_index(name, table, cols, unique=True)
+        if _pg():
+            existing = {u["name"] for u in sa.inspect(op.get_bind()).get_unique_constraints(table)}
+            if name not in existing:
+                op.execute(f"ALTER TABLE {table} ADD CONSTRAINT {name} UNIQUE USING INDEX {name}")
+    _create_index("ux_games_room_active", "games", ["room_id"], unique=True, where=sa.text("finished = false" if _pg() else "finished = 0"))
+    _create_index("ix_phases_unresolved_ends_at", "phases", ["ends_at"], where=sa.text("resolved_at IS NULL"))
+
+
+def downgrade() -> None:
+    _drop_index("ix_phases_unresolved_ends_at", "phases")
+    _drop_index("ux_games_room_active", "games")
+    for name, table, _, _ in reversed(UNIQUES):
+        if _pg():
+            op.execute(f"ALTER TABLE {table} DROP CONSTRAINT IF EXISTS {name}")
+        _drop_index(name, table)
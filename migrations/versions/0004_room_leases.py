@@ -0,0 +1,32 @@
+"""room_leases for room-affinity sharding
+
+Revision ID: 0004
+Revises: 0003
+Create Date: 2026-10-17 00:00:03
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = "0004"
+down_revision: Union[str, None] = "0003"
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    if not sa.inspect(op.get_bind()).has_table("room_leases"):
+        op.create_table("room_leases",
+                        sa.Column("room_id", sa.Integer, sa.ForeignKey("rooms.id"), primary_key=True),
+                        sa.Column("worker_id", sa.String(64), nullable=False),
+                        sa.Column("expires_at", sa.DateTime, nullable=False))
+        op.create_index("ix_room_leases_worker_id", "room_leases", ["worker_id"])
+
+
+def downgrade() -> None:
+    op.drop_index("ix_room_leases_worker_id", table_name="room_leases")
+    op.drop_table("room_leases")
@@ -0,0 +1,47 @@
+"""game event journal and snapshots
+
+Revision ID: 0005
+Revises: 0004
+Create Date: 2026-10-17 00:00:04
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = "0005"
+down_revision: Union[str, None] = "0004"
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    insp = sa.inspect(op.get_bind())
+    if not insp.has_table("game_events"):
+        op.create_table("game_events",
+                        sa.Column("id", sa.Integer, primary_key=True),
+                        sa.Column("game_id", sa.Integer, sa.ForeignKey("games.id"), nullable=False),
+                        sa.Column("seq", sa.Integer, nullable=False),
+                        sa.Column("phase_number", sa.Integer, nullable=True),
+                        sa.Column("kind", sa.String(32), nullable=False),
+                        sa.Column("payload", sa.JSON),
+                        sa.Column("created_at", sa.DateTime),
+                        sa.UniqueConstraint("game_id", "seq", name="uq_game_events_game_seq"))
+    if not insp.has_table("game_snapshots"):
+        op.create_table("game_snapshots",
+                        sa.Column("id", sa.Integer, primary_key=True),
+                        sa.Column("game_id", sa.Integer, sa.ForeignKey("games.id"), nullable=False),
+                        sa.Column("seq", sa.Integer, nullable=False),
+                        sa.Column("phase_number", sa.Integer, nullable=True),
+                        sa.Column("state", sa.JSON, nullable=False),
+                        sa.Column("created_at", sa.DateTime))
+        op.create_index("ix_game_snapshots_game_seq", "game_snapshots", ["game_id", "seq"])
+
+
+def downgrade() -> None:
+    op.drop_index("ix_game_snapshots_game_seq", table_name="game_snapshots")
+    op.drop_table("game_snapshots")
+    op.drop_table("game_events")
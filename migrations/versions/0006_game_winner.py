@@ -0,0 +1,34 @@
+"""games.winner / games.finished_at
+
+均为可空列、无默认值，PostgreSQL 上只改元数据。
+
+Revision ID: 0006
+Revises: 0005
+Create Date: 2026-10-17 00:00:05
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = "0006"
+down_revision: Union[str, None] = "0005"
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    cols = {c["name"] for c in sa.inspect(op.get_bind()).get_columns("games")}
+    if "winner" not in cols:
+        op.add_column("games", sa.Column("winner", sa.String(16), nullable=True))
+    if "finished_at" not in cols:
+        op.add_column("games", sa.Column("finished_at", sa.DateTime, nullable=True))
+
+
+def downgrade() -> None:
+    with op.batch_alter_table("games") as batch:
+        batch.drop_column("finished_at")
+        batch.drop_column("winner")
@@ -0,0 +1,34 @@
+"""game_archives cold storage
+
+Revision ID: 0007
+Revises: 0006
+Create Date: 2026-10-17 00:00:06
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = "0007"
+down_revision: Union[str, None] = "0006"
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    insp = sa.inspect(op.get_bind())
+    if not insp.has_table("game_archives"):
+        op.create_table("game_archives",
+                        sa.Column("game_id", sa.Integer, sa.ForeignKey("games.id"), primary_key=True),
+                        sa.Column("rows", sa.Integer, nullable=False),
+                        sa.Column("data", sa.LargeBinary, nullable=False),
+                        sa.Column("archived_at", sa.DateTime))
+        op.create_index("ix_game_archives_archived_at", "game_archives", ["archived_at"])
+
+
+def downgrade() -> None:
+    op.drop_index("ix_game_archives_archived_at", table_name="game_archives")
+    op.drop_table("game_archives")
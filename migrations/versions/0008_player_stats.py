@@ -0,0 +1,53 @@
+"""user_stats / role_stats rollups and games.stats_at
+
+Revision ID: 0008
+Revises: 0007
+Create Date: 2026-10-17 00:00:07
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = "0008"
+down_revision: Union[str, None] = "0007"
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+STAT_COLS = ("games", "wins", "survived", "votes", "votes_correct", "seer_checks", "seer_hits")
+CAMP_COLS = ("games_villager", "wins_villager", "games_werewolf", "wins_werewolf", "games_neutral", "wins_neutral")
+
+
+def _counters(cols):
+    return [sa.Column(c, sa.Integer, nullable=False, server_default="0") for c in cols]
+
+
+def upgrade() -> None:
+    insp = sa.inspect(op.get_bind())
+    if "stats_at" not in {c["name"] for c in insp.get_columns("games")}:
+        op.add_column("games", sa.Column("stats_at", sa.DateTime, nullable=True))
+    pg = op.get_bind().dialect.name == "postgresql"
+    where = sa.text("stats_at IS NULL AND finished = " + ("true" if pg else "1"))
+    op.create_index("ix_games_stats_pending", "games", ["id"], if_not_exists=True,
+                    postgresql_where=where, sqlite_where=where)
+    if not insp.has_table("user_stats"):
+        op.create_table("user_stats",
+                        sa.Column("user_id", sa.Integer, sa.ForeignKey("users.id"), primary_key=True),
+                        *_counters(STAT_COLS + CAMP_COLS))
+        op.create_index("ix_user_stats_wins", "user_stats", ["wins"])
+    if not insp.has_table("role_stats"):
+        op.create_table("role_stats",
+                        sa.Column("role_key", sa.String(32), primary_key=True),
+                        *_counters(STAT_COLS))
+
+
+def downgrade() -> None:
+    op.drop_table("role_stats")
+    op.drop_index("ix_user_stats_wins", table_name="user_stats")
+    op.drop_table("user_stats")
+    op.drop_index("ix_games_stats_pending", table_name="games", if_exists=True)
+    with op.batch_alter_table("games") as batch:
+        batch.drop_column("stats_at")
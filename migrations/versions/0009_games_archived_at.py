@@ -0,0 +1,37 @@
+"""games.archived_at
+
+Revision ID: 0009
+Revises: 0008
+Create Date: 2026-10-17 00:00:08
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = "0009"
+down_revision: Union[str, None] = "0008"
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    insp = sa.inspect(op.get_bind())
+    if "archived_at" not in {c["name"] for c in insp.get_columns("games")}:
+        op.add_column("games", sa.Column("archived_at", sa.DateTime, nullable=True))
+    # 已有归档的对局补上时间；此前已过期删除的归档无法区分，按未归档处理
+    op.execute("UPDATE games SET archived_at = (SELECT a.archived_at FROM game_archives a WHERE a.game_id = games.id) "
+               "WHERE archived_at IS NULL AND EXISTS (SELECT 1 FROM game_archives a WHERE a.game_id = games.id)")
+    pg = op.get_bind().dialect.name == "postgresql"
+    where = sa.text("archived_at IS NULL AND finished = " + ("true" if pg else "1"))
+    op.create_index("ix_games_archive_pending", "games", ["id"], if_not_exists=True,
+                    postgresql_where=where, sqlite_where=where)
+
+
+def downgrade() -> None:
+    op.drop_index("ix_games_archive_pending", table_name="games", if_exists=True)
+    with op.batch_alter_table("games") as batch:
+        batch.drop_column("archived_at")
@@ -1,5 +1,5 @@
 from datetime import datetime
-from sqlalchemy import Column, Integer, String, Boolean, DateTime, ForeignKey, JSON
+from sqlalchemy import Column, Integer, String, Boolean, DateTime, ForeignKey, JSON, LargeBinary, Index, UniqueConstraint, false, true
 from sqlalchemy.orm import declarative_base, relationship
 from flask_login import UserMixin
 
@@ -28,6 +28,7 @@ class Membership(Base):
     id = Column(Integer, primary_key=True)
     user_id = Column(Integer, ForeignKey("users.id"), nullable=False)
     room_id = Column(Integer, ForeignKey("rooms.id"), nullable=False)
+    __table_args__ = (UniqueConstraint("room_id", "user_id", name="uq_memberships_room_user"),)
 
 class Game(Base):
     __tablename__ = "games"
@@ -35,6 +36,17 @@ class Game(Base):
     room_id = Column(Integer, ForeignKey("rooms.id"), nullable=False)
     created_at = Column(DateTime, default=datetime.utcnow)
     finished = Column(Boolean, default=False)
+    winner = Column(String(16), nullable=True)      # villager/werewolf/lovers/piper/angel/jester
+    finished_at = Column(DateTime, nullable=True)
+    stats_at = Column(DateTime, nullable=True)      # 计入 user_stats/role_stats 的时间，保证每局只统计一次
+    archived_at = Column(DateTime, nullable=True)   # 移入 game_archives 的时间；归档过期删除后仍保留，不会被再次归档
+    # 每个房间最多一局进行中的对局
+    __table_args__ = (Index("ux_games_room_active", "room_id", unique=True,
+                            postgresql_where=finished==false(), sqlite_where=finished==false()),
+                      Index("ix_games_stats_pending", "id", postgresql_where=stats_at.is_(None) & (finished==true()),
+                            sqlite_where=stats_at.is_(None) & (finished==true())),
+                      Index("ix_games_archive_pending", "id", postgresql_where=archived_at.is_(None) & (finished==true()),
+                            sqlite_where=archived_at.is_(None) & (finished==true())))
 
 class Phase(Base):
     __tablename__ = "phases"
@@ -43,6 +55,10 @@ class Phase(Base):
     number = Column(Integer, nullable=False)
     type = Column(String(16), nullable=False)  # night/day
     ends_at = Column(DateTime, nullable=True)
+    resolved_at = Column(DateTime, nullable=True)  # 结算后写入，用于多进程抢占
+    __table_args__ = (UniqueConstraint("game_id", "number", name="uq_phases_game_number"),
+                      Index("ix_phases_unresolved_ends_at", "ends_at",
+                            postgresql_where=resolved_at.is_(None), sqlite_where=resolved_at.is_(None)))
 
 class Role(Base):
     __tablename__ = "roles"
@@ -69,6 +85,7 @@ class PlayerState(Base):
     role_id = Column(Integer, ForeignKey("roles.id"), nullable=False)
     alive = Column(Boolean, default=True)
     meta = Column(JSON, default=dict)
+    __table_args__ = (UniqueConstraint("game_id", "user_id", name="uq_player_states_game_user"),)
 
 class Action(Base):
     __tablename__ = "actions"
@@ -79,3 +96,83 @@ class Action(Base):
     type = Column(String(32), nullable=False)  # wolf_kill, seer_peek, etc.
     target_user_id = Column(Integer, ForeignKey("users.id"), nullable=True)
     created_at = Column(DateTime, default=datetime.utcnow)
+    __table_args__ = (UniqueConstraint("game_id", "phase_number", "actor_user_id", name="uq_actions_game_phase_actor"),)
+
+class RoomLease(Base):
+    __tablename__ = "room_leases"
+    room_id = Column(Integer, ForeignKey("rooms.id"), primary_key=True)
+    worker_id = Column(String(64), nullable=False, index=True)
+    expires_at = Column(DateTime, nullable=False)
+
+class GameEvent(Base):
+    __tablename__ = "game_events"
+    id = Column(Integer, primary_key=True)
+    game_id = Column(Integer, ForeignKey("games.id"), nullable=False)
+    seq = Column(Integer, nullable=False)
+    phase_number = Column(Integer, nullable=True)
+    kind = Column(String(32), nullable=False)  # phase_opened / action_submitted / player_died / role_effect ...
+    payload = Column(JSON, default=dict)
+    created_at = Column(DateTime, default=datetime.utcnow)
+    __table_args__ = (UniqueConstraint("game_id", "seq", name="uq_game_events_game_seq"),)
+
+class GameSnapshot(Base):
+    __tablename__ = "game_snapshots"
+    id = Column(Integer, primary_key=True)
+    game_id = Column(Integer, ForeignKey("games.id"), nullable=False)
+    seq = Column(Integer, nullable=False)          # 快照包含到该序号为止的全部事件
+    phase_number = Column(Integer, nullable=True)
+    state = Column(JSON, nullable=False)
+    created_at = Column(DateTime, default=datetime.utcnow)
+    __table_args__ = (Index("ix_game_snapshots_game_seq", "game_id", "seq"),)
+
+class GameArchive(Base):
+    # 已结束对局的冷存储：players/phases/actions/events 压缩成一段 JSON lines，活跃表中的对应行随后删除
+    __tablename__ = "game_archives"
+    game_id = Column(Integer, ForeignKey("games.id"), primary_key=True)
+    rows = Column(Integer, nullable=False)
+    data = Column(LargeBinary, nullable=False)      # zlib(JSON lines)
+    archived_at = Column(DateTime, default=datetime.utcnow, index=True)
+
+class UserStats(Base):
+    # 按局增量累加的玩家汇总；比率在读取时计算
+    __tablename__ = "user_stats"
+    user_id = Column(Integer, ForeignKey("users.id"), primary_key=True)
+    games = Column(Integer, nullable=False, default=0)
+    wins = Column(Integer, nullable=False, default=0, index=True)
+    survived = Column(Integer, nullable=False, default=0)
+    votes = Column(Integer, nullable=False, default=0)
+    votes_correct = Column(Integer, nullable=False, default=0)   # 投给了对立阵营
+    seer_checks = Column(Integer, nullable=False, default=0)
+    seer_hits = Column(Integer, nullable=False, default=0)       # 查验到狼
+    games_villager = Column(Integer, nullable=False, default=0)
+    wins_villager = Column(Integer, nullable=False, default=0)
+    games_werewolf = Column(Integer, nullable=False, default=0)
+    wins_werewolf = Column(Integer, nullable=False, default=0)
+    games_neutral = Column(Integer, nullable=False, default=0)
+    wins_neutral = Column(Integer, nullable=False, default=0)
+
+class RoleStats(Base):
+    __tablename__ = "role_stats"
+    role_key = Column(String(32), primary_key=True)
+    games = Column(Integer, nullable=False, default=0)
+    wins = Column(Integer, nullable=False, default=0)
+    survived = Column(Integer, nullable=False, default=0)
+    votes = Column(Integer, nullable=False, default=0)
+    votes_correct = Column(Integer, nullable=False, default=0)
+    seer_checks = Column(Integer, nullable=False, default=0)
+    seer_hits = Column(Integer, nullable=False, default=0)
+
+def dialect_insert(db, model):
+    # 支持 ON CONFLICT 的 INSERT 构造（PostgreSQL 与 SQLite）
+    if db.bind.dialect.name == "postgresql": from sqlalchemy.dialects.postgresql import insert
+    else: from sqlalchemy.dialects.sqlite import insert
+    return insert(model)
+
+def upsert(db, model, rows, index_elements, update_cols=()):
+    # INSERT ... ON CONFLICT；update_cols 为空时冲突即忽略
+    stmt = dialect_insert(db, model).values(rows)
+    if update_cols:
+        stmt = stmt.on_conflict_do_update(index_elements=index_elements, set_={c: stmt.excluded[c] for c in update_cols})
+    else:
+        stmt = stmt.on_conflict_do_nothing(index_elements=index_elements)
+    return db.execute(stmt)
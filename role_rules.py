@@ -0,0 +1,363 @@
+from __future__ import annotations
+import random
+from collections import Counter
+from functools import lru_cache
+from typing import Callable, Dict, FrozenSet, List, Optional
+
+# 角色规则注册表：每个角色技能是一个带优先级的规则对象，按房间实际出现的角色编译出结算计划，
+# 结算只执行在场角色的规则。新增角色 = 新增一个 @register 规则类，不再修改结算流程。
+#
+# 结算顺序（数字越小越先）：
+#   夜晚  10 丘比特/野孩子（首夜） 20 守卫 30 预言家/狐狸/小女孩/熊 40 狼刀 45 狼美人
+#         50 女巫解药 55 种狼（指定当晚免死的狼） 60 狼刀落地 70 女巫毒药 80 吹笛者/乌鸦
+#   白天  10 骑士决斗 20 计票 30 替罪羊 40 小丑 50 白痴 60 放逐
+#   死亡  情侣殉情、狼美人带走、野孩子转狼，在每次死亡时按优先级触发；猎人/白狼王只在结果中标记可开枪，开枪行动尚未实现
+
+WOLF_KEYS = {"werewolf","white_wolf_king","wolfdog","wolf_beauty","demon"}      # 预言家查验为狼
+KILLER_KEYS = WOLF_KEYS | {"wild_wolf","breeder_wolf"}                           # 参与夜间狼刀
+
+class Resolution:
+    # 一次结算的上下文；roles 为 {uid: (role_key, camp, alive, meta)}，结算过程原地修改
+    def __init__(self, roles: dict, actions, tally=None, phase_number: int = 0):
+        self.roles = roles; self.actions = actions; self.tally = tally
+        self.phase_number = phase_number
+        self.by_type: Dict[str, list] = {}
+        for a in actions: self.by_type.setdefault(a.type, []).append(a)
+        self.results: dict = {}
+        self.dead: List[int] = []; self.causes: Dict[int, str] = {}
+        self.touched = set()
+        self.protected = set(); self.healed = None; self.wolf_target = None
+        self.reprieve: Dict[int, Callable[[], None]] = {}   # 本次结算中免死一次的玩家 -> 免死时的回调
+        self.death_rules: list = []
+
+    def key(self, uid) -> Optional[str]:
+        r = self.roles.get(uid)
+        return r[0] if r else None
+
+    def alive(self, uid) -> bool:
+        r = self.roles.get(uid)
+        return bool(r and r[2])
+
+    def holders(self, keys) -> List[int]:
+        return [uid for uid, r in self.roles.items() if r[2] and r[0] in keys]
+
+    def acts(self, type_: str, keys=None):
+        # 指定类型的行动，且行动者当前存活（并持有 keys 中的身份）
+        return [a for a in self.by_type.get(type_, ()) if self.alive(a.actor_user_id) and (keys is None or self.key(a.actor_user_id) in keys)]
+
+    def meta(self, uid) -> dict:
+        self.touched.add(uid)
+        return self.roles[uid][3]
+
+    def neighbours(self, uid) -> List[int]:
+        # 按座位顺序取左右最近的存活玩家
+        seats = [u for u, r in self.roles.items() if r[2] or u == uid]
+        if len(seats) < 3 or uid not in seats: return [u for u in seats if u != uid]
+        i = seats.index(uid)
+        return [seats[i - 1], seats[(i + 1) % len(seats)]]
+
+    def kill(self, uid, cause: str) -> bool:
+        r = self.roles.get(uid)
+        if not r or not r[2]: return False
+        save = self.reprieve.pop(uid, None)
+        if save: save(); return False          # 在死亡生效前拦下，死亡连锁与结算结果都不会出现
+        self.roles[uid] = (r[0], r[1], False, r[3])
+        self.dead.append(uid); self.causes[uid] = cause
+        for rule in self.death_rules: rule.on_death(self, uid, cause)
+        return True
+
+class Rule:
+    phase = "night"                    # night / day / death
+    priority = 100
+    roles: FrozenSet[str] = frozenset()  # 在场才启用；为空表示总是启用
+    actors: FrozenSet[str] = frozenset() # 夜间必须行动的身份（决定何时可提前结算）
+    first_night = False                  # 只在第一夜行动
+    action = ""                          # 读取的行动类型
+
+    def apply(self, r: Resolution): pass
+    def on_death(self, r: Resolution, uid: int, cause: str): pass
+
+REGISTRY: List[Rule] = []
+
+def register(cls):
+    REGISTRY.append(cls()); compile_plan.cache_clear()
+    return cls
+
+class Plan:
+    def __init__(self, keys: FrozenSet[str]):
+        enabled = [rule for rule in REGISTRY if not rule.roles or rule.roles & keys]
+        by_phase = lambda p: sorted((x for x in enabled if x.phase == p), key=lambda x: x.priority)
+        self.keys = keys
+        self.night, self.day, self.death = by_phase("night"), by_phase("day"), by_phase("death")
+
+    def resolve(self, phase_type: str, roles: dict, actions, tally=None, phase_number: int = 0) -> Resolution:
+        r = Resolution(roles, actions, tally, phase_number)
+        r.death_rules = self.death
+        for rule in (self.night if phase_type == "night" else self.day): rule.apply(r)
+        return r
+
+@lru_cache(maxsize=256)
+def compile_plan(keys: FrozenSet[str]) -> Plan:
+    # 同一房间配置（角色集合）只编译一次
+    return Plan(keys)
+
+def plan_for(roles: dict) -> Plan:
+    return compile_plan(frozenset(r[0] for r in roles.values()))
+
+def action_types(phase: str) -> set:
+    # 某阶段可提交的行动类型（含跳过），其余一律拒绝
+    return {rule.action for rule in REGISTRY if rule.phase == phase and rule.action} | {"skip"}
+
+def night_actors(first_night: bool = False) -> set:
+    return {k for rule in REGISTRY if rule.phase == "night" and (first_night or not rule.first_night) for k in rule.actors}
+
+# ---------------- 夜晚 ----------------
+
+@register
+class CupidRule(Rule):
+    priority = 10; action = "bind_couple"; roles = actors = frozenset({"cupid"}); first_night = True
+    def apply(self, r):
+        for a in r.acts(self.action, self.roles):
+            pair = [a.target_user_id, (a.meta or {}).get("target2")]
+            if all(u in r.roles for u in pair) and pair[0] != pair[1]:
+                r.meta(pair[0])["lover"] = pair[1]; r.meta(pair[1])["lover"] = pair[0]
+                r.results["couple"] = pair
+
+@register
+class WildKidRule(Rule):
+    priority = 11; action = "choose_master"; roles = actors = frozenset({"wild_kid"}); first_night = True
+    def apply(self, r):
+        for a in r.acts(self.action, self.roles):
+            if a.target_user_id in r.roles and a.target_user_id != a.actor_user_id:
+                r.meta(a.actor_user_id)["master"] = a.target_user_id
+
+@register
+class GuardianRule(Rule):
+    priority = 20; action = "guardian_protect"; roles = actors = frozenset({"guardian"})
+    def apply(self, r):
+        for a in r.acts(self.action, self.roles):
+            m = r.meta(a.actor_user_id)
+            if a.target_user_id and m.get("last_guard") != a.target_user_id:  # 不能连续两晚守同一人
+                r.protected.add(a.target_user_id)
+            m["last_guard"] = a.target_user_id
+
+@register
+class SeerRule(Rule):
+    priority = 30; action = "seer_peek"; roles = actors = frozenset({"seer"})
+    def apply(self, r):
+        for a in r.acts(self.action, self.roles):
+            r.results.setdefault("seer", []).append({"actor": a.actor_user_id, "target": a.target_user_id,
+                                                     "is_wolf": r.key(a.target_user_id) in WOLF_KEYS})
+
+@register
+class FoxRule(Rule):
+    # 查验目标及其左右邻座三人中是否有狼；没查到狼则失去技能
+    priority = 31; action = "fox_sniff"; roles = actors = frozenset({"fox"})
+    def apply(self, r):
+        for a in r.acts(self.action, self.roles):
+            m = r.meta(a.actor_user_id)
+            if m.get("fox_lost") or a.target_user_id not in r.roles: continue
+            group = [a.target_user_id] + r.neighbours(a.target_user_id)
+            found = any(r.key(u) in WOLF_KEYS for u in group)
+            if not found: m["fox_lost"] = True
+            r.results.setdefault("fox", []).append({"actor": a.actor_user_id, "group": group, "has_wolf": found})
+
+@register
+class LittleGirlRule(Rule):
+    # 被动技能：每晚偷看到一名存活的狼人
+    priority = 32; roles = frozenset({"little_girl"})
+    def apply(self, r):
+        wolves = sorted(r.holders(KILLER_KEYS))
+        if not wolves: return
+        for uid in r.holders(self.roles):
+            rng = random.Random(f"{r.phase_number}:{uid}")
+            r.results.setdefault("little_girl", []).append({"actor": uid, "wolf": rng.choice(wolves)})
+
+@register
+class BearRule(Rule):
+    # 被动技能：邻座有狼时公开提醒
+    priority = 33; roles = frozenset({"bear"})
+    def apply(self, r):
+        for uid in r.holders(self.roles):
+            if any(r.key(u) in KILLER_KEYS for u in r.neighbours(uid)): r.results["bear_growl"] = True
+
+@register
+class WolfKillRule(Rule):
+    priority = 40; action = "wolf_kill"; roles = frozenset(KILLER_KEYS); actors = frozenset(KILLER_KEYS)
+    def apply(self, r):
+        c = r.tally.wolf_votes if r.tally is not None else Counter(a.target_user_id for a in r.acts(self.action, self.actors) if a.target_user_id)
+        if c: r.wolf_target = c.most_common(1)[0][0]
+
+@register
+class WolfBeautyRule(Rule):
+    # 狼美人每晚魅惑一人，狼美人死亡时被魅惑者同死
+    priority = 45; action = "beauty_charm"; roles = frozenset({"wolf_beauty"})
+    def apply(self, r):
+        for a in r.acts(self.action, self.roles):
+            if a.target_user_id in r.roles: r.meta(a.actor_user_id)["linked"] = a.target_user_id
+
+@register
+class WitchHealRule(Rule):
+    priority = 50; action = "witch_heal"; roles = actors = frozenset({"witch"})
+    def apply(self, r):
+        for a in r.acts(self.action, self.roles):
+            m = r.meta(a.actor_user_id)
+            if m.get("heal_used"): continue
+            m["heal_used"] = True; r.healed = a.target_user_id
+
+@register
+class BreederWolfRule(Rule):
+    # 种狼：指定一名狼人，当晚若将死亡则免死一次（在狼刀/毒药生效前登记，死亡连锁不会触发）
+    priority = 55; action = "breeder_revive"; roles = frozenset({"breeder_wolf"})
+    def apply(self, r):
+        for a in r.acts(self.action, self.roles):
+            m, t = r.meta(a.actor_user_id), a.target_user_id
+            if m.get("revive_used") or r.key(t) not in KILLER_KEYS or not r.alive(t): continue
+            def save(m=m, t=t): m["revive_used"] = True; r.results["revived"] = t
+            r.reprieve[t] = save
+
+@register
+class WolfKillLandsRule(Rule):
+    priority = 60; roles = frozenset(KILLER_KEYS)
+    def apply(self, r):
+        t = r.wolf_target
+        if not t: return
+        if t in r.protected: r.results["guarded"] = t
+        elif r.healed == t: r.results["healed"] = t
+        elif r.kill(t, "wolf"): r.results["killed"] = t
+
+@register
+class WitchPoisonRule(Rule):
+    priority = 70; action = "witch_poison"; roles = frozenset({"witch"})
+    def apply(self, r):
+        for a in r.acts(self.action, self.roles):
+            m = r.meta(a.actor_user_id)
+            if m.get("poison_used"): continue
+            m["poison_used"] = True
+            if r.kill(a.target_user_id, "poison"): r.results.setdefault("poisoned", []).append(a.target_user_id)
+
+@register
+class PiperRule(Rule):
+    priority = 80; action = "piper_charm"; roles = actors = frozenset({"piper"})
+    def apply(self, r):
+        for a in r.acts(self.action, self.roles):
+            for u in (a.target_user_id, (a.meta or {}).get("target2")):
+                if u in r.roles:
+                    r.meta(u)["charmed"] = True; r.results.setdefault("charmed", []).append(u)
+
+@register
+class RavenRule(Rule):
+    priority = 81; action = "raven_mark"; roles = actors = frozenset({"raven"})
+    def apply(self, r):
+        for a in r.acts(self.action, self.roles):
+            if a.target_user_id in r.roles:
+                r.meta(a.target_user_id)["raven_mark"] = r.phase_number + 1   # 次日白天 +1 票
+                r.results.setdefault("raven_mark", []).append(a.target_user_id)
+
+# ---------------- 白天 ----------------
+
+@register
+class KnightRule(Rule):
+    # 骑士白天翻牌决斗：对方是狼则狼死并立即结束白天，否则骑士自己死
+    priority = 10; action = "knight_duel"; phase = "day"; roles = frozenset({"knight"})
+    def apply(self, r):
+        for a in r.acts(self.action, self.roles):
+            m = r.meta(a.actor_user_id)
+            if m.get("duel_used") or not r.alive(a.target_user_id): continue
+            m["duel_used"] = True
+            won = r.key(a.target_user_id) in KILLER_KEYS
+            r.kill(a.target_user_id if won else a.actor_user_id, "duel")
+            r.results["knight"] = {"actor": a.actor_user_id, "target": a.target_user_id, "won": won}
+            if won: r.results["exiled"] = None; r.results["day_over"] = True
+            return
+
+@register
+class VoteTallyRule(Rule):
+    priority = 20; action = "day_vote"; phase = "day"
+    def apply(self, r):
+        if r.results.get("day_over"): return
+        if r.tally is not None: votes = Counter(r.tally.votes)
+        else:
+            votes = Counter()
+            for a in r.acts(self.action):
+                if a.target_user_id: votes[a.target_user_id] += 2 if r.key(a.actor_user_id) == "village_head" else 1
+        for uid, (_, _, alive, meta) in r.roles.items():
+            if alive and meta.get("raven_mark") == r.phase_number: votes[uid] += 1
+        votes = Counter({u: n for u, n in votes.items() if r.alive(u)})
+        if not votes: r.results["exiled"] = None; r.results["day_over"] = True; return
+        top, count = votes.most_common(1)[0]
+        r.results["_top"] = top; r.results["_tied"] = [u for u, n in votes.items() if n == count]
+
+@register
+class ScapegoatRule(Rule):
+    priority = 30; phase = "day"; roles = frozenset({"scapegoat"})
+    def apply(self, r):
+        if r.results.get("day_over") or len(r.results.get("_tied", ())) < 2: return
+        goats = r.holders(self.roles)
+        if goats:
+            r.kill(goats[0], "scapegoat")
+            r.results.update(exiled=goats[0], scapegoat=True, day_over=True)
+
+@register
+class JesterRule(Rule):
+    priority = 40; phase = "day"; roles = frozenset({"jester"})
+    def apply(self, r):
+        top = r.results.get("_top")
+        if r.results.get("day_over") or r.key(top) != "jester": return
+        r.kill(top, "exile")
+        r.results.update(exiled=top, win="jester", day_over=True)
+
+@register
+class IdiotRule(Rule):
+    priority = 50; phase = "day"; roles = frozenset({"idiot"})
+    def apply(self, r):
+        top = r.results.get("_top")
+        if r.results.get("day_over") or r.key(top) != "idiot": return
+        m = r.roles[top][3]
+        if not m.get("survived_once", False):
+            r.meta(top)["survived_once"] = True
+            r.results.update(idiot_revealed=top, exiled=None, day_over=True)
+
+@register
+class ExileRule(Rule):
+    priority = 60; phase = "day"
+    def apply(self, r):
+        top = r.results.pop("_top", None); r.results.pop("_tied", None)
+        if r.results.pop("day_over", False): return
+        r.kill(top, "exile")
+        r.results["exiled"] = top
+
+# ---------------- 死亡连锁 ----------------
+
+@register
+class LoversRule(Rule):
+    priority = 10; phase = "death"; roles = frozenset({"cupid"})
+    def on_death(self, r, uid, cause):
+        lover = r.roles[uid][3].get("lover")
+        if lover and r.kill(lover, "heartbreak"): r.results.setdefault("heartbreak", []).append(lover)
+
+@register
+class WolfBeautyDeathRule(Rule):
+    priority = 20; phase = "death"; roles = frozenset({"wolf_beauty"})
+    def on_death(self, r, uid, cause):
+        if r.key(uid) != "wolf_beauty": return
+        linked = r.roles[uid][3].get("linked")
+        if linked and r.kill(linked, "wolf_beauty"): r.results["beauty_victim"] = linked
+
+@register
+class HunterRule(Rule):
+    # 只标记：猎人死亡可开枪（被毒死除外），白狼王仅在白天被放逐时可带人；开枪的后续行动尚未实现
+    priority = 30; phase = "death"; roles = frozenset({"hunter", "white_wolf_king"})
+    def on_death(self, r, uid, cause):
+        k = r.key(uid)
+        if k == "hunter" and cause != "poison": r.results["hunter_ready"] = uid
+        if k == "white_wolf_king" and cause == "exile": r.results["white_wolf_power"] = uid
+
+@register
+class WildKidDeathRule(Rule):
+    priority = 40; phase = "death"; roles = frozenset({"wild_kid"})
+    def on_death(self, r, uid, cause):
+        for kid in r.holders(self.roles):
+            m = r.roles[kid][3]
+            if m.get("master") == uid and m.get("camp") != "werewolf":
+                r.meta(kid)["camp"] = "werewolf"; r.results.setdefault("wild_kid_turned", []).append(kid)
@@ -0,0 +1,106 @@
+from __future__ import annotations
+import bisect, logging, threading
+from datetime import datetime, timedelta
+from typing import Dict, Optional
+from sqlalchemy import func
+from models import Room, User, Membership, Game
+
+log = logging.getLogger(__name__)
+
+# 大厅房间目录：进程内维护房间索引（人数、上限、对局状态），
+# /api/rooms 按 id 倒序做 keyset 分页，变更通过 Socket.IO 的 lobby 频道增量推送。
+
+class RoomEntry:
+    __slots__ = ("id", "name", "owner", "members", "max_players", "status", "touched_at")
+    def __init__(self, id, name, owner, members=0, max_players=8, status="waiting", touched_at=None):
+        self.id = id; self.name = name; self.owner = owner; self.members = members
+        self.max_players = max_players; self.status = status
+        self.touched_at = touched_at or datetime.utcnow()
+
+    def to_dict(self) -> dict:
+        return {"id": self.id, "name": self.name, "owner": self.owner, "members": self.members,
+                "max_players": self.max_players, "status": self.status}
+
+class RoomDirectory:
+    def __init__(self, session_factory, emit, idle: timedelta = timedelta(hours=24), refresh: float = 60.0):
+        self.session_factory = session_factory
+        self.emit = emit                      # emit(event, payload)，推送到 lobby 频道
+        self.idle = idle; self.refresh = refresh
+        self._rooms: Dict[int, RoomEntry] = {}
+        self._ids = []                        # 升序房间 id，用于 keyset 分页
+        self._lock = threading.Lock()
+
+    def load(self):
+        # 一次聚合查询重建索引；多进程部署时定期调用以吸收其他进程的变更
+        db = self.session_factory()
+        try:
+            counts = (db.query(Membership.room_id, func.count(Membership.id).label("n"))
+                      .group_by(Membership.room_id).subquery())
+            active = db.query(Game.room_id).filter(Game.finished==False).subquery()
+            rows = (db.query(Room.id, Room.name, User.nickname, func.coalesce(counts.c.n, 0), Room.max_players,
+                             active.c.room_id, Room.created_at)
+                    .outerjoin(User, User.id==Room.owner_id)
+                    .outerjoin(counts, counts.c.room_id==Room.id)
+                    .outerjoin(active, active.c.room_id==Room.id).all())
+        finally: db.close()
+        cutoff = datetime.utcnow() - self.idle
+        rooms = {}
+        with self._lock:
+            for rid, name, owner, n, max_players, playing, created_at in rows:
+                old = self._rooms.get(rid)
+                touched = old.touched_at if old else (created_at or datetime.utcnow())
+                # 已过期且不在索引中的房间不再载入；索引中的过期房间留给 sweep 推送 remove
+                if not playing and old is None and touched < cutoff: continue
+                rooms[rid] = RoomEntry(rid, name, owner or "-", n, max_players or 8, "playing" if playing else "waiting", touched)
+            self._rooms = rooms; self._ids = sorted(rooms)
+        return len(rooms)
+
+    def page(self, before: Optional[int] = None, limit: int = 20) -> dict:
+        limit = max(1, min(100, limit))
+        with self._lock:
+            end = len(self._ids) if before is None else bisect.bisect_left(self._ids, before)
+            ids = self._ids[max(0, end - limit):end][::-1]
+            items = [self._rooms[i].to_dict() for i in ids]
+        return {"rooms": items, "next": ids[-1] if len(ids) == limit and end - limit > 0 else None}
+
+    def add(self, room: Room, owner: str, members: int = 0):
+        e = RoomEntry(room.id, room.name, owner, members, room.max_players or 8)
+        with self._lock:
+            if room.id not in self._rooms: bisect.insort(self._ids, room.id)
+            self._rooms[room.id] = e
+        self.emit("lobby_room_add", e.to_dict())
+
+    def _update(self, room_id: int, **fields):
+        with self._lock:
+            e = self._rooms.get(room_id)
+            if e is None: return
+            for k, v in fields.items(): setattr(e, k, v)
+            e.touched_at = datetime.utcnow()
+            payload = e.to_dict()
+        self.emit("lobby_room_update", payload)
+
+    def member_joined(self, room_id: int):
+        e = self._rooms.get(room_id)
+        if e: self._update(room_id, members=e.members + 1)
+
+    def set_status(self, room_id: int, status: str): self._update(room_id, status=status)
+
+    def remove(self, room_id: int):
+        with self._lock:
+            if self._rooms.pop(room_id, None) is None: return
+            i = bisect.bisect_left(self._ids, room_id); del self._ids[i]
+        self.emit("lobby_room_remove", {"id": room_id})
+
+    def sweep(self):
+        # 长时间无人加入、未在对局中的房间移出目录
+        cutoff = datetime.utcnow() - self.idle
+        for rid in [e.id for e in list(self._rooms.values()) if e.status != "playing" and e.touched_at < cutoff]:
+            self.remove(rid)
+
+    def run(self, sleep):
+        while True:
+            sleep(self.refresh)
+            try: self.load(); self.sweep()
+            except Exception: log.exception("room directory refresh failed")
+
+    def __len__(self): return len(self._rooms)
@@ -0,0 +1,164 @@
+from __future__ import annotations
+import logging, os, socket, threading, time
+from datetime import datetime, timedelta
+from typing import Callable, Dict, Optional
+from sqlalchemy import update
+from models import RoomLease, upsert
+
+log = logging.getLogger(__name__)
+
+# 多进程按房间分片：每个房间由持有 room_leases 租约的进程独占处理，
+# 其他进程收到该房间的 Socket.IO 事件时通过队列转发给租约持有者。
+# 持有者停止续约后租约在 ttl 内过期，下一个事件到来的进程接管并从数据库重建状态。
+
+def kombu_connection_args(url: str):
+    # filesystem:///path 作为本地多进程测试的队列替身，其余 URL 原样交给 kombu
+    if url.startswith("filesystem://"):
+        path = url[len("filesystem://"):] or "/tmp/werewolf-queue"
+        os.makedirs(os.path.join(path, "control"), exist_ok=True)
+        return "filesystem://", {"transport_options": {"data_folder_in": path, "data_folder_out": path,
+                                                      "control_folder": os.path.join(path, "control")}}
+    return url, {}
+
+class LeaseManager:
+    def __init__(self, session_factory, worker_id: str, ttl: float = 15.0):
+        self.session_factory = session_factory; self.worker_id = worker_id
+        self.ttl = timedelta(seconds=ttl)
+        self._owned: Dict[int, datetime] = {}       # 本进程持有的房间 -> 到期时间
+        self._foreign: Dict[int, tuple] = {}        # 其他进程持有的房间 -> (worker_id, 缓存到期)
+        self._lock = threading.Lock()
+
+    def owns(self, room_id: int) -> bool:
+        exp = self._owned.get(room_id)
+        return exp is not None and exp > datetime.utcnow()
+
+    def owner(self, room_id: int) -> str:
+        if self.owns(room_id): return self.worker_id
+        now = datetime.utcnow()
+        hit = self._foreign.get(room_id)
+        if hit and hit[1] > now: return hit[0]
+        db = self.session_factory()
+        try:
+            exp = now + self.ttl
+            # 不存在则插入；已过期则抢占；否则读出当前持有者
+            upsert(db, RoomLease, [{"room_id": room_id, "worker_id": self.worker_id, "expires_at": exp}], ["room_id"])
+            db.execute(update(RoomLease).where(RoomLease.room_id==room_id, RoomLease.expires_at < now)
+                       .values(worker_id=self.worker_id, expires_at=exp))
+            db.commit()
+            lease = db.get(RoomLease, room_id)
+            owner, lease_exp = lease.worker_id, lease.expires_at
+        finally: db.close()
+        with self._lock:
+            if owner == self.worker_id:
+                self._owned[room_id] = lease_exp; self._foreign.pop(room_id, None)
+            else:
+                # 只短暂缓存他人租约，持有者宕机后尽快重新争抢
+                self._foreign[room_id] = (owner, min(lease_exp, now + self.ttl / 5))
+        return owner
+
+    def renew(self) -> set:
+        # 一条 UPDATE 续约全部持有的房间，返回已失去的房间
+        if not self._owned: return set()
+        now = datetime.utcnow()
+        db = self.session_factory()
+        try:
+            db.execute(update(RoomLease).where(RoomLease.worker_id==self.worker_id)
+                       .values(expires_at=now + self.ttl))
+            db.commit()
+            still = {rid for (rid,) in db.query(RoomLease.room_id).filter(RoomLease.worker_id==self.worker_id)}
+        finally: db.close()
+        with self._lock:
+            lost = set(self._owned) - still
+            for rid in lost: self._owned.pop(rid, None)
+            for rid in still: self._owned[rid] = now + self.ttl
+        return lost
+
+    def release_all(self):
+        db = self.session_factory()
+        try:
+            db.query(RoomLease).filter(RoomLease.worker_id==self.worker_id).delete(); db.commit()
+        finally: db.close()
+        with self._lock: self._owned.clear()
+
+class KombuTransport:
+    # 每个进程一个点对点队列 werewolf.worker.<id>
+    def __init__(self, url: str, worker_id: str):
+        import kombu  # 仅分片模式需要：pip install kombu
+        url, opts = kombu_connection_args(url)
+        self.conn = kombu.Connection(url, **opts)
+        self.worker_id = worker_id
+        self._inbox = self.conn.SimpleQueue(self._name(worker_id))
+        self._lock = threading.Lock()
+
+    def _name(self, worker_id): return f"werewolf.worker.{worker_id}"
+
+    def publish(self, worker_id: str, msg: dict):
+        with self._lock:
+            q = self.conn.SimpleQueue(self._name(worker_id))
+            try: q.put(msg)
+            finally: q.close()
+
+    def poll(self, limit: int = 100):
+        out = []
+        for _ in range(limit):
+            try: m = self._inbox.get(block=False)
+            except Exception: break
+            m.ack(); out.append(m.payload)
+        return out
+
+class RoomRouter:
+    def __init__(self, leases: Optional[LeaseManager] = None, transport=None, on_change: Callable = None,
+                 poll_interval: float = 0.01, heartbeat: float = 5.0):
+        self.leases = leases; self.transport = transport
+        self.on_change = on_change or (lambda rid: None)   # 获得/失去租约时调用，用于丢弃本地内存状态
+        self.poll_interval = poll_interval; self.heartbeat = heartbeat
+        self._handlers: Dict[str, Callable] = {}
+
+    @property
+    def enabled(self) -> bool: return self.leases is not None
+
+    def handler(self, event: str):
+        def deco(fn):
+            self._handlers[event] = fn
+            return fn
+        return deco
+
+    def is_local(self, room_id: int) -> bool:
+        return not self.enabled or self.leases.owns(room_id)
+
+    def dispatch(self, event: str, room_id: int, user_id=None, sid=None, data=None, hops: int = 0):
+        if not self.enabled:
+            return self._handlers[event](room_id, user_id, sid, data or {})
+        held = self.leases.owns(room_id)
+        owner = self.leases.owner(room_id)
+        if owner == self.leases.worker_id:
+            if not held: self.on_change(room_id)   # 刚接管：内存状态可能落后，重新从库加载
+            return self._handlers[event](room_id, user_id, sid, data or {})
+        if hops >= 3:
+            log.warning("dropping %s for room %s after %s hops", event, room_id, hops); return
+        self.transport.publish(owner, {"event": event, "room_id": room_id, "user_id": user_id, "sid": sid,
+                                       "data": data or {}, "hops": hops + 1, "ts": time.time()})
+
+    def _deliver(self, msg: dict):
+        # 过期消息（持有者宕机期间积压）直接丢弃，客户端会重试
+        if time.time() - msg.get("ts", 0) > self.leases.ttl.total_seconds(): return
+        self.dispatch(msg["event"], msg["room_id"], msg.get("user_id"), msg.get("sid"), msg.get("data"), msg.get("hops", 0))
+
+    def run(self, sleep):
+        last_beat = 0.0
+        while True:
+            now = time.monotonic()
+            if now - last_beat >= self.heartbeat:
+                last_beat = now
+                try:
+                    for rid in self.leases.renew(): self.on_change(rid)
+                except Exception: log.exception("lease renew failed")
+            try: msgs = self.transport.poll()
+            except Exception: log.exception("router poll failed"); msgs = []
+            for m in msgs:
+                try: self._deliver(m)
+                except Exception: log.exception("forwarded event failed: %s", m.get("event"))
+            if not msgs: sleep(self.poll_interval)
+
+def default_worker_id() -> str:
+    return os.getenv("WORKER_ID") or f"{socket.gethostname()}-{os.getpid()}"
@@ -0,0 +1,77 @@
+from __future__ import annotations
+import heapq, logging, threading
+from datetime import datetime, timedelta
+from models import Game, Phase
+
+log = logging.getLogger(__name__)
+
+# 全部房间共用一个最小堆 + 一个后台循环，而不是每个房间一个 greenlet。
+# 多进程部署时每个进程都会定期从 phases 表同步即将到期的阶段，
+# 触发前由 game_engine.claim_phase 做条件更新，保证每个截止时间只被一个进程处理。
+
+class DeadlineScheduler:
+    def __init__(self, session_factory, fire, refresh: float = 5.0, max_sleep: float = 1.0):
+        self.session_factory = session_factory
+        self.fire = fire                      # fire(room_id, game_id, phase_id)
+        self.refresh = refresh; self.max_sleep = max_sleep
+        self._heap = []                       # (ends_at, phase_id, game_id, room_id)
+        self._known = set()                   # 已在堆中且未取消的 phase_id，避免同步时重复入堆
+        self._lock = threading.Lock()
+        self._last_sync = None
+
+    def add(self, room_id: int, game_id: int, phase_id: int, ends_at: datetime):
+        if ends_at is None: return
+        with self._lock:
+            if phase_id in self._known: return
+            self._known.add(phase_id)
+            heapq.heappush(self._heap, (ends_at, phase_id, game_id, room_id))
+
+    def cancel(self, phase_id: int):
+        # 阶段已提前结算：堆中的条目留到到期时丢弃，不再触发
+        with self._lock: self._known.discard(phase_id)
+
+    def sync(self, horizon: timedelta = None):
+        # 启动时 horizon=None 全量重建；之后只拉取即将到期的未结算阶段（可能由其他进程创建）
+        db = self.session_factory()
+        try:
+            # 进行中对局只有当前阶段未结算：直接走部分索引 ix_phases_unresolved_ends_at，不对 phases 全表聚合
+            q = (db.query(Phase.id, Phase.game_id, Phase.ends_at, Game.room_id)
+                 .join(Game, Game.id==Phase.game_id)
+                 .filter(Phase.resolved_at.is_(None), Phase.ends_at.isnot(None), Game.finished==False))
+            if horizon is not None: q = q.filter(Phase.ends_at <= datetime.utcnow() + horizon)
+            rows = q.all()
+        finally: db.close()
+        for phase_id, game_id, ends_at, room_id in rows:
+            self.add(room_id, game_id, phase_id, ends_at)
+        self._last_sync = datetime.utcnow()
+        return len(rows)
+
+    def pop_due(self, now: datetime):
+        due = []
+        with self._lock:
+            while self._heap and self._heap[0][0] <= now:
+                ends_at, phase_id, game_id, room_id = heapq.heappop(self._heap)
+                if phase_id not in self._known: continue
+                self._known.discard(phase_id)
+                due.append((room_id, game_id, phase_id))
+        return due
+
+    def seconds_until_next(self, now: datetime) -> float:
+        with self._lock:
+            if not self._heap: return self.max_sleep
+            return max(0.0, min(self.max_sleep, (self._heap[0][0] - now).total_seconds()))
+
+    def run(self, sleep):
+        try: self.sync()
+        except Exception: log.exception("deadline scheduler initial sync failed")
+        while True:
+            now = datetime.utcnow()
+            if self._last_sync is None or (now - self._last_sync).total_seconds() >= self.refresh:
+                try: self.sync(timedelta(seconds=self.refresh * 2))
+                except Exception: log.exception("deadline scheduler sync failed")
+            for room_id, game_id, phase_id in self.pop_due(now):
+                try: self.fire(room_id, game_id, phase_id)
+                except Exception: log.exception("deadline fire failed: room=%s phase=%s", room_id, phase_id)
+            sleep(self.seconds_until_next(datetime.utcnow()))
+
+    def __len__(self): return len(self._heap)
@@ -1,5 +1,55 @@
+import os, threading, time
+from collections import OrderedDict
+from passlib.exc import MissingBackendError
 from passlib.hash import bcrypt
-def hash_password(raw: str) -> str: return bcrypt.hash(raw)
+
+# bcrypt 计算耗时 100ms 级，放到 eventlet 原生线程池执行，避免冻结整个 hub。
+# 线程池大小由 EVENTLET_THREADPOOL_SIZE 控制（默认 4），超出的调用在池内排队。
+try:
+    from eventlet import tpool
+    tpool.set_num_threads(int(os.getenv("EVENTLET_THREADPOOL_SIZE", "4")))
+except ImportError: tpool = None
+
+# 必须使用 bcrypt C 扩展（计算时释放 GIL）；passlib 的 os_crypt 后备实现全程持有 GIL，放进 tpool 仍会阻塞 hub
+try: bcrypt.set_backend("bcrypt")
+except MissingBackendError: raise RuntimeError("缺少 bcrypt 扩展，请执行 pip install -r requirements.txt") from None
+
+BCRYPT_ROUNDS = int(os.getenv("BCRYPT_ROUNDS", "12"))
+_bcrypt = bcrypt.using(rounds=BCRYPT_ROUNDS)
+
+def _offload(fn, *args):
+    return tpool.execute(fn, *args) if tpool is not None else fn(*args)
+
+def hash_password(raw: str) -> str: return _offload(_bcrypt.hash, raw)
 def verify_password(raw: str, hashed: str) -> bool:
-    try: return bcrypt.verify(raw, hashed)
+    try: return _offload(_bcrypt.verify, raw, hashed)
     except Exception: return False
+def needs_rehash(hashed: str) -> bool:
+    # BCRYPT_ROUNDS 调整后，登录成功时用新参数重新哈希
+    try: return _bcrypt.needs_update(hashed)
+    except Exception: return False
+
+class IdentityCache:
+    # 短 TTL 的进程内用户缓存，避免每个 HTTP 请求/Socket 事件都查一次 users 表
+    def __init__(self, loader, ttl: float = 30.0, maxsize: int = 10000):
+        self.loader = loader; self.ttl = ttl; self.maxsize = maxsize
+        self._items = OrderedDict()   # user_id -> (expires_at, user)
+        self._lock = threading.Lock()
+
+    def get(self, user_id: int):
+        now = time.monotonic()
+        with self._lock:
+            hit = self._items.get(user_id)
+            if hit and hit[0] > now:
+                self._items.move_to_end(user_id)
+                return hit[1]
+        user = self.loader(user_id)
+        if user is not None:
+            with self._lock:
+                self._items[user_id] = (now + self.ttl, user)
+                self._items.move_to_end(user_id)
+                while len(self._items) > self.maxsize: self._items.popitem(last=False)
+        return user
+
+    def invalidate(self, user_id: int):
+        with self._lock: self._items.pop(user_id, None)
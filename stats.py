@@ -0,0 +1,175 @@
+from __future__ import annotations
+import argparse, logging, os, sys
+from collections import Counter
+from datetime import datetime
+from typing import Optional
+from sqlalchemy import update, delete
+from models import Game, Role, User, UserStats, RoleStats, dialect_insert
+from archive import load_game
+from role_rules import WOLF_KEYS
+from security import IdentityCache
+
+log = logging.getLogger(__name__)
+
+# 玩家/身份统计：每局结束后把该局的结果累加进 user_stats / role_stats 两张汇总表，
+# 读取只查汇总表（带进程内 TTL 缓存），不对 games / player_states / actions 做全表聚合。
+# 每局数据通过 archive.load_game 读取，已归档的对局同样适用；games.stats_at 的条件更新保证每局只计一次。
+#
+#   python stats.py --backfill     统计所有尚未计入的历史对局
+#   python stats.py --rebuild      清空汇总表后重新统计全部历史
+
+STAT_COLS = ("games", "wins", "survived", "votes", "votes_correct", "seer_checks", "seer_hits")
+CAMPS = ("villager", "werewolf", "neutral")
+CAMP_COLS = tuple(f"{k}_{c}" for c in CAMPS for k in ("games", "wins"))
+LEADERBOARD = {"wins": UserStats.wins, "games": UserStats.games,
+               "win_rate": UserStats.wins * 1.0 / UserStats.games}
+STATS_INTERVAL = float(os.getenv("STATS_INTERVAL", "5"))
+
+def _won(winner: str, key: str, camp: str, meta: dict) -> bool:
+    if winner in ("villager", "werewolf"): return camp == winner
+    if winner == "lovers": return bool(meta.get("lover")) or key == "cupid"
+    return key == winner                      # piper / angel / jester
+
+def game_rows(record: dict, roles: dict):
+    # 返回 ({user_id: Counter}, {role_key: Counter})；roles 为 role_id -> (key, camp)
+    winner = record["game"]["winner"]
+    players = {}
+    for ps in record["player_states"]:
+        key, camp = roles.get(ps["role_id"], (None, None))
+        meta = ps["meta"] or {}
+        camp = meta.get("camp") or camp
+        players[ps["user_id"]] = (key, camp if camp in CAMPS else "neutral", ps["alive"], meta)
+    users = {}
+    for uid, (key, camp, alive, meta) in players.items():
+        won = int(_won(winner, key, camp, meta))
+        users[uid] = Counter({"games": 1, "wins": won, "survived": int(bool(alive)), f"games_{camp}": 1, f"wins_{camp}": won})
+    for a in record["actions"]:
+        actor, target = players.get(a["actor_user_id"]), players.get(a["target_user_id"])
+        if not actor or not target: continue
+        c = users[a["actor_user_id"]]
+        if a["type"] == "day_vote":
+            # 投票准确：好人投狼 / 狼投好人
+            c["votes"] += 1; c["votes_correct"] += (actor[1] == "werewolf") != (target[1] == "werewolf")
+        elif a["type"] == "seer_peek":
+            c["seer_checks"] += 1; c["seer_hits"] += target[0] in WOLF_KEYS
+    by_role = {}
+    for uid, c in users.items():
+        key = players[uid][0]
+        if key: by_role.setdefault(key, Counter()).update({k: c[k] for k in STAT_COLS})
+    return users, by_role
+
+def _increment(db, model, key: str, rows: dict, cols):
+    if not rows: return
+    stmt = dialect_insert(db, model).values([{key: k, **{col: c[col] for col in cols}} for k, c in rows.items()])
+    db.execute(stmt.on_conflict_do_update(index_elements=[key],
+                                          set_={col: getattr(model, col) + stmt.excluded[col] for col in cols}))
+
+def role_map(db) -> dict:
+    return {rid: (key, camp) for rid, key, camp in db.query(Role.id, Role.key, Role.camp)}
+
+def apply_game(db, game_id: int, roles: Optional[dict] = None) -> Optional[set]:
+    # 计入一局；已被其他进程计入时返回 None，否则返回涉及的玩家
+    claimed = db.execute(update(Game).where(Game.id==game_id, Game.stats_at.is_(None))
+                         .values(stats_at=datetime.utcnow())).rowcount
+    if not claimed: db.rollback(); return None
+    record = load_game(db, game_id)
+    users, by_role = {}, {}
+    if record and record["game"]["winner"]:   # 被新开局顶替的对局没有胜方，不计入
+        users, by_role = game_rows(record, roles or role_map(db))
+    _increment(db, UserStats, "user_id", users, STAT_COLS + CAMP_COLS)
+    _increment(db, RoleStats, "role_key", by_role, STAT_COLS)
+    db.commit()
+    return set(users)
+
+def pending(db, limit: Optional[int] = 100) -> list:
+    return [gid for (gid,) in db.query(Game.id).filter(Game.finished==True, Game.stats_at.is_(None))
+            .order_by(Game.id).limit(limit)]
+
+def _rates(d: dict) -> dict:
+    div = lambda a, b: round(a / b, 4) if b else None
+    return {**d, "win_rate": div(d["wins"], d["games"]), "survival_rate": div(d["survived"], d["games"]),
+            "vote_accuracy": div(d["votes_correct"], d["votes"]), "seer_hit_rate": div(d["seer_hits"], d["seer_checks"])}
+
+def _row(obj, cols) -> dict: return {c: getattr(obj, c) for c in cols}
+
+class Stats:
+    def __init__(self, session_factory, flush=None, ttl: float = 30.0):
+        self.session_factory = session_factory
+        self.flush = flush                    # 统计前先把 WriteBehind 中的行动落盘
+        self.cache = IdentityCache(self._load, ttl=ttl)   # 同一个 TTL + LRU 缓存，键为 ("user", id) 等元组
+
+    def process(self, limit: Optional[int] = 100) -> int:
+        if self.flush: self.flush()
+        db = self.session_factory()
+        try:
+            ids = pending(db, limit)
+            if not ids: return 0
+            roles = role_map(db); n = 0
+            for gid in ids:
+                users = apply_game(db, gid, roles)
+                if users is None: continue
+                n += 1
+                for uid in users: self.cache.invalidate(("user", uid))
+            if n: self.cache.invalidate(("roles",))
+            return n
+        finally: db.close()
+
+    def run(self, sleep, interval: float = STATS_INTERVAL):
+        while True:
+            sleep(interval)
+            try: self.process()
+            except Exception: log.exception("stats update failed")
+
+    # ---- 读取 ----
+    def user(self, user_id: int) -> Optional[dict]: return self.cache.get(("user", user_id)) or None
+    def roles(self) -> list: return self.cache.get(("roles",))
+    def leaderboard(self, by: str = "wins", limit: int = 20, min_games: int = 5) -> list:
+        return self.cache.get(("top", by, limit, min_games))
+
+    def _load(self, key):
+        db = self.session_factory()
+        try:
+            if key[0] == "user":
+                row = db.query(UserStats, User.nickname).join(User, User.id==UserStats.user_id).filter(UserStats.user_id==key[1]).first()
+                if not row: return {}
+                s, nickname = row
+                d = _rates({"user_id": s.user_id, "nickname": nickname, **_row(s, STAT_COLS)})
+                d["camps"] = {c: {"games": getattr(s, f"games_{c}"), "wins": getattr(s, f"wins_{c}")} for c in CAMPS}
+                return d
+            if key[0] == "roles":
+                return [_rates({"role_key": r.role_key, **_row(r, STAT_COLS)}) for r in db.query(RoleStats).order_by(RoleStats.role_key)]
+            _, by, limit, min_games = key
+            q = (db.query(UserStats, User.nickname).join(User, User.id==UserStats.user_id)
+                 .filter(UserStats.games >= min_games).order_by(LEADERBOARD[by].desc(), UserStats.user_id).limit(limit))
+            return [_rates({"user_id": s.user_id, "nickname": nickname, **_row(s, STAT_COLS)}) for s, nickname in q]
+        finally: db.close()
+
+def main(argv=None):
+    from dotenv import load_dotenv
+    load_dotenv()
+    ap = argparse.ArgumentParser(description="统计历史对局，写入 user_stats / role_stats")
+    ap.add_argument("--db", default=os.getenv("DATABASE_URL"))
+    ap.add_argument("--backfill", action="store_true", help="统计所有尚未计入的已结束对局")
+    ap.add_argument("--rebuild", action="store_true", help="清空汇总表并重新统计全部历史")
+    ap.add_argument("--batch", type=int, default=500)
+    args = ap.parse_args(argv)
+    if not args.db: raise SystemExit("DATABASE_URL 未设置")
+    if not (args.backfill or args.rebuild): ap.error("需要 --backfill 或 --rebuild")
+    from sqlalchemy.orm import sessionmaker
+    from database import make_engine
+    Session = sessionmaker(bind=make_engine(args.db, green=False))
+    if args.rebuild:
+        with Session() as db:
+            db.execute(delete(UserStats)); db.execute(delete(RoleStats))
+            db.execute(update(Game).where(Game.stats_at.isnot(None)).values(stats_at=None))
+            db.commit()
+    stats, total = Stats(Session), 0
+    while True:
+        n = stats.process(args.batch)
+        if not n: break
+        total += n; print(f"{total} games", file=sys.stderr)
+    print(total, "games counted")
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main())
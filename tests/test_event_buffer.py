@@ -0,0 +1,25 @@
+from fanout import EventBuffer
+
+def push(buf, event, *auds):
+    return buf.append(1, event, {a: {"event": event, "aud": a} for a in auds})
+
+def test_since_returns_only_own_audiences_in_order():
+    buf = EventBuffer(8)
+    s0 = buf.last_seq(1)
+    push(buf, "game_started", "all", "user:1", "user:2")
+    push(buf, "phase_change", "all", "wolves")
+    got = buf.since(1, s0, {"all", "user:1"})
+    assert [(e, p["aud"]) for e, p in got] == [("game_started", "all"), ("game_started", "user:1"), ("phase_change", "all")]
+    assert buf.since(1, buf.last_seq(1), {"all"}) == [] and buf.since(1, buf.last_seq(1) + 1, {"all"}) is None
+
+def test_buffer_is_bounded_by_events_not_payloads():
+    buf = EventBuffer(2)
+    s0 = buf.last_seq(1)
+    push(buf, "game_started", "all", *(f"user:{i}" for i in range(12)))
+    s2 = push(buf, "phase_change", "all", *(f"user:{i}" for i in range(12)))
+    assert len(buf.since(1, s0, {"all", "user:1"})) == 4
+    push(buf, "phase_change", "all", "user:1")
+    # 第一个事件被整体淘汰：从它之前续传只能改发快照，不会只拿到部分载荷
+    assert buf.since(1, s0, {"all", "user:1"}) is None
+    assert [p["aud"] for _, p in buf.since(1, s0 + 1, {"all", "user:1"})] == ["all", "user:1", "all", "user:1"]
+    assert s2 == s0 + 2
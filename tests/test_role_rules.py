@@ -0,0 +1,109 @@
+from game_state import ActionSlot, PhaseTally, GameState, PlayerSlot
+from role_rules import plan_for, action_types
+
+def table(*keys):
+    # uid 从 1 开始，按座位顺序
+    camp = lambda k: "werewolf" if k in ("werewolf", "wolf_beauty", "breeder_wolf") else "villager"
+    return {i: (k, camp(k), True, {}) for i, k in enumerate(keys, 1)}
+
+def night(roles, *acts, number=2, tally=None):
+    # acts: (actor, type, target[, meta])
+    return plan_for(roles).resolve("night", roles, [ActionSlot(*a) for a in acts], tally, number)
+
+def alive(roles, uid): return roles[uid][2]
+
+# ---- 守卫 / 女巫 / 狼刀 的先后 ----
+
+def test_guard_blocks_wolf_kill():
+    roles = table("werewolf", "guardian", "villager")
+    r = night(roles, (1, "wolf_kill", 3), (2, "guardian_protect", 3))
+    assert alive(roles, 3) and r.results["guarded"] == 3 and not r.dead
+
+def test_guard_cannot_repeat_target():
+    roles = table("werewolf", "guardian", "villager")
+    roles[2][3]["last_guard"] = 3
+    r = night(roles, (1, "wolf_kill", 3), (2, "guardian_protect", 3))
+    assert r.dead == [3] and r.results["killed"] == 3
+
+def test_heal_saves_and_is_used_once():
+    roles = table("werewolf", "witch", "villager")
+    r = night(roles, (1, "wolf_kill", 3), (2, "witch_heal", 3))
+    assert alive(roles, 3) and r.results["healed"] == 3 and roles[2][3]["heal_used"]
+    r = night(roles, (1, "wolf_kill", 3), (2, "witch_heal", 3), number=4)
+    assert r.dead == [3]
+
+def test_guard_takes_precedence_over_heal():
+    roles = table("werewolf", "guardian", "witch", "villager")
+    r = night(roles, (1, "wolf_kill", 4), (2, "guardian_protect", 4), (3, "witch_heal", 4))
+    assert alive(roles, 4) and r.results["guarded"] == 4 and "healed" not in r.results
+
+def test_poison_lands_after_kill_and_ignores_guard():
+    roles = table("werewolf", "guardian", "witch", "villager", "villager")
+    r = night(roles, (1, "wolf_kill", 4), (2, "guardian_protect", 5), (3, "witch_poison", 5))
+    assert r.dead == [4, 5] and r.causes == {4: "wolf", 5: "poison"}
+
+def test_wolf_kill_from_non_killer_is_ignored():
+    roles = table("werewolf", "seer", "villager", "villager")
+    r = night(roles, (1, "wolf_kill", 3), (2, "wolf_kill", 4), (4, "wolf_kill", 4))
+    assert r.dead == [3]
+    tally = PhaseTally([1, 2])
+    tally.update(1, "wolf_kill", 3, "werewolf"); tally.update(2, "wolf_kill", 4, "seer")
+    assert dict(tally.wolf_votes) == {3: 1} and tally.complete
+
+# ---- 死亡连锁 ----
+
+def test_lovers_die_together():
+    roles = table("werewolf", "cupid", "villager", "villager")
+    r = night(roles, (2, "bind_couple", 3, {"target2": 4}), number=1)
+    assert r.results["couple"] == [3, 4] and roles[3][3]["lover"] == 4
+    r = night(roles, (1, "wolf_kill", 3), number=2)
+    assert r.dead == [3, 4] and r.causes[4] == "heartbreak"
+
+def test_wolf_beauty_takes_charmed_player_when_poisoned():
+    roles = table("wolf_beauty", "witch", "villager", "villager")
+    r = night(roles, (1, "beauty_charm", 3), (2, "witch_poison", 1))
+    assert r.dead == [1, 3] and r.causes[3] == "wolf_beauty" and r.results["beauty_victim"] == 3
+
+def test_lover_of_charmed_player_chains():
+    roles = table("wolf_beauty", "witch", "cupid", "villager", "villager")
+    roles[4][3]["lover"] = 5; roles[5][3]["lover"] = 4
+    r = night(roles, (1, "beauty_charm", 4), (2, "witch_poison", 1))
+    assert r.dead == [1, 4, 5]
+
+def test_breeder_reprieve_stops_death_chain_and_summary():
+    roles = table("werewolf", "witch", "breeder_wolf", "cupid", "villager")
+    roles[1][3]["lover"] = 5; roles[5][3]["lover"] = 1
+    r = night(roles, (2, "witch_poison", 1), (3, "breeder_revive", 1))
+    assert r.dead == [] and "poisoned" not in r.results and r.results["revived"] == 1
+    assert alive(roles, 1) and alive(roles, 5) and roles[3][3]["revive_used"] and roles[2][3]["poison_used"]
+
+def test_breeder_reprieve_unused_when_target_survives():
+    roles = table("werewolf", "breeder_wolf", "villager")
+    r = night(roles, (1, "wolf_kill", 3), (2, "breeder_revive", 1))
+    assert r.dead == [3] and "revived" not in r.results and not roles[2][3].get("revive_used")
+
+def test_hunter_cannot_shoot_when_poisoned():
+    roles = table("werewolf", "witch", "hunter", "hunter")
+    r = night(roles, (1, "wolf_kill", 3), (2, "witch_poison", 4))
+    assert r.results["hunter_ready"] == 3 and r.dead == [3, 4]
+
+# ---- 白天 ----
+
+def test_knight_duel_win_skips_exile():
+    roles = table("werewolf", "knight", "villager", "villager")
+    actions = [ActionSlot(2, "knight_duel", 1), ActionSlot(3, "day_vote", 4), ActionSlot(4, "day_vote", 4)]
+    r = plan_for(roles).resolve("day", roles, actions, None, 2)
+    assert r.dead == [1] and r.results["knight"]["won"] and r.results["exiled"] is None
+
+def test_duel_wins_matches_knight_rule():
+    st = GameState(1, 1)
+    for uid, (key, camp) in {1: ("werewolf", "werewolf"), 2: ("knight", "villager"), 3: ("villager", "villager")}.items():
+        st.players[uid] = PlayerSlot(uid, uid, key, camp)
+    assert st.duel_wins(2, 1) and not st.duel_wins(2, 3) and not st.duel_wins(3, 1)
+    st.players[2].meta["duel_used"] = True
+    assert not st.duel_wins(2, 1)
+
+def test_plan_only_runs_rules_in_play():
+    plan = plan_for(table("werewolf", "villager"))
+    assert [type(x).__name__ for x in plan.night] == ["WolfKillRule", "WolfKillLandsRule"]
+    assert "guardian_protect" in action_types("night") and "day_vote" not in action_types("night")
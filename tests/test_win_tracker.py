@@ -0,0 +1,68 @@
+from models import Phase
+from game_state import PlayerSlot, WinTracker
+
+CAMPS = {"werewolf": "werewolf", "wolf_beauty": "werewolf", "piper": "neutral", "angel": "neutral", "jester": "neutral"}
+
+def players(*keys):
+    return {i: PlayerSlot(i, i, k, CAMPS.get(k, "villager")) for i, k in enumerate(keys, 1)}
+
+def night(n=3): return Phase(type="night", number=n)
+def day(n=4): return Phase(type="day", number=n)
+
+def kill(ps, wins, *uids, touched=()):
+    for u in uids: ps[u].alive = False
+    wins.update(ps, list(uids), touched)
+
+def test_no_winner_at_start():
+    ps = players("werewolf", "werewolf", "seer", "villager", "villager", "villager")
+    assert WinTracker(ps).winner(night(1), {}) is None
+
+def test_villagers_win_when_wolves_are_gone():
+    ps = players("werewolf", "seer", "villager", "villager")
+    wins = WinTracker(ps); kill(ps, wins, 1)
+    assert wins.winner(day(), {}) == "villager"
+
+def test_wolves_win_on_parity():
+    ps = players("werewolf", "werewolf", "seer", "villager", "villager")
+    wins = WinTracker(ps); kill(ps, wins, 3)
+    assert wins.winner(night(), {}) == "werewolf"
+
+def test_jester_from_summary_beats_everything():
+    ps = players("werewolf", "jester", "villager")
+    assert WinTracker(ps).winner(day(), {"win": "jester"}) == "jester"
+
+def test_angel_wins_surviving_first_day_only():
+    ps = players("werewolf", "angel", "villager", "villager", "villager")
+    wins = WinTracker(ps)
+    assert wins.winner(day(2), {}) == "angel" and wins.winner(day(4), {}) is None
+    kill(ps, wins, 2)
+    assert wins.winner(day(2), {}) is None
+
+def test_lovers_win_as_last_two_across_camps():
+    ps = players("werewolf", "cupid", "villager", "villager")
+    wins = WinTracker(ps)
+    ps[1].meta["lover"] = 3; ps[3].meta["lover"] = 1
+    wins.update(ps, [], [1, 3])
+    assert wins.winner(night(), {}) is None
+    kill(ps, wins, 2, 4)
+    assert wins.winner(day(), {}) == "lovers"
+
+def test_piper_wins_when_everyone_else_is_charmed():
+    ps = players("werewolf", "piper", "villager", "villager")
+    wins = WinTracker(ps)
+    for u in (1, 3): ps[u].meta["charmed"] = True
+    wins.update(ps, [], [1, 3])
+    assert wins.winner(night(), {}) is None
+    ps[4].meta["charmed"] = True; kill(ps, wins, 4, touched=[4])   # 被魅惑后同一夜死亡，只扣一次
+    assert wins.uncharmed == 0 and wins.winner(night(), {}) == "piper"
+
+def test_incremental_matches_recount():
+    ps = players("werewolf", "wolf_beauty", "wild_kid", "piper", "cupid", "villager", "villager", "seer")
+    wins = WinTracker(ps)
+    ps[6].meta["lover"] = 7; ps[7].meta["lover"] = 6; ps[5].meta["charmed"] = True
+    wins.update(ps, [], [5, 6, 7])
+    ps[3].meta["camp"] = "werewolf"; kill(ps, wins, 8, touched=[3])     # 师父死亡，野孩子转狼
+    ps[6].meta["charmed"] = True; kill(ps, wins, 6, 7, touched=[6])
+    fresh = WinTracker(ps)
+    for f in ("alive", "lovers", "lovers_alive", "uncharmed", "pipers", "angels"):
+        assert getattr(wins, f) == getattr(fresh, f), f
@@ -0,0 +1,35 @@
+import eventlet
+from sqlalchemy import create_engine, event
+from sqlalchemy.orm import sessionmaker
+from sqlalchemy.pool import StaticPool
+from models import Base, Action
+from game_state import WriteBehind, ActionSlot
+
+def make_writer():
+    engine = create_engine("sqlite://", connect_args={"check_same_thread": False}, poolclass=StaticPool)
+    Base.metadata.create_all(engine)
+    Session = sessionmaker(bind=engine)
+    return engine, Session, WriteBehind(Session)
+
+def targets(Session):
+    with Session() as db: return [t for (t,) in db.query(Action.target_user_id).order_by(Action.actor_user_id)]
+
+def test_concurrent_flushes_keep_newest_action():
+    engine, Session, w = make_writer()
+    first = [True]
+    @event.listens_for(engine, "before_cursor_execute")
+    def _yield(*a):
+        # 第一个批次执行语句时让出 hub，模拟 psycopg2 等待网络
+        if first[0]: first[0] = False; eventlet.sleep(0.05)
+    w.put_action(1, 1, ActionSlot(2, "day_vote", 3))
+    a = eventlet.spawn(w.flush); eventlet.sleep(0)
+    w.put_action(1, 1, ActionSlot(2, "day_vote", 4))
+    b = eventlet.spawn(w.flush); a.wait(); b.wait()
+    assert targets(Session) == [4]
+
+def test_bad_row_is_dropped_not_retried_forever():
+    _, Session, w = make_writer()
+    w.put_action(1, 1, ActionSlot(2, None, None)); w.put_action(1, 1, ActionSlot(3, "wolf_kill", 4))
+    assert w.flush() == 1 and targets(Session) == [4]
+    w.put_action(1, 2, ActionSlot(3, "wolf_kill", 5))
+    assert w.flush() == 1